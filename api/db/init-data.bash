@@ -6,6 +6,14 @@ db_exec() {
     psql $DB_URL -c "$1"
 }
 
+# Rewrite a docs table with the doc_id of each row's paper, dropping rows for
+# papers that are not in the metadata
+add_doc_ids() {
+    db_exec "CREATE TABLE docs.$1_with_ids AS SELECT m.doc_id, t.* FROM docs.$1 t JOIN docs.doc_meta_0 m ON m.dkey = t.dkey"
+    db_exec "DROP TABLE docs.$1"
+    db_exec "ALTER TABLE docs.$1_with_ids RENAME TO $1"
+}
+
 db_exec 'DROP SCHEMA IF EXISTS docs CASCADE'
 db_exec 'CREATE SCHEMA docs'
 # index data sets role to "roger"
@@ -21,15 +29,44 @@ echo 'Remove non-unique metadata dkeys'
 db_exec 'DELETE FROM docs.doc_meta_0 WHERE dkey NOT IN (SELECT dkey FROM docs.doc_meta_0 GROUP BY dkey HAVING count(*) = 1)'
 db_exec 'ALTER TABLE docs.doc_meta_0 ADD PRIMARY KEY (dkey)'
 
+echo 'Assign document ids'
+
+# Dense integer ids for papers, so datasets and joins work on integers
+db_exec 'ALTER TABLE docs.doc_meta_0 ADD COLUMN doc_id serial UNIQUE'
+
+echo 'Convert publication dates'
+
+# Publication dates are loaded as text, which can not be compared with the
+# timestamps filter tasks send. Dates that do not parse become null.
+db_exec 'CREATE FUNCTION docs.to_timestamp_or_null(value text) RETURNS timestamp AS $$ BEGIN RETURN value::timestamp; EXCEPTION WHEN others THEN RETURN NULL; END $$ LANGUAGE plpgsql IMMUTABLE'
+db_exec 'ALTER TABLE docs.doc_meta_0 ALTER COLUMN pub_date TYPE timestamp USING docs.to_timestamp_or_null(pub_date)'
+db_exec 'DROP FUNCTION docs.to_timestamp_or_null'
+
 echo 'Unzip keywords (~40 minutes)'
 unzip -p ~/data/GeneralIndex.keywords.0/doc_keywords_0.sql.zip | tqdm --dynamic-ncols --smoothing 0 --unit-scale --total 1240042165 | psql $DB_URL
+add_doc_ids doc_keywords_0
+
+echo 'Build keyword postings'
+
+# One row per distinct keyword with the papers it appears in, so filter tasks
+# are a primary key lookup instead of a scan over doc_keywords_0
+db_exec 'CREATE TABLE docs.doc_keyword_postings_0 AS SELECT keywords_lc, array_agg(DISTINCT doc_id ORDER BY doc_id) AS doc_ids, count(DISTINCT doc_id) AS doc_freq FROM docs.doc_keywords_0 WHERE keywords_lc IS NOT NULL GROUP BY keywords_lc'
+db_exec 'ALTER TABLE docs.doc_keyword_postings_0 ADD PRIMARY KEY (keywords_lc)'
+
+echo 'Create indices for keywords and metadata'
+
+# Keyword score and token count filters are range scans within a keyword, and
+# publication date filters are index-only range scans over dates
+db_exec 'CREATE INDEX doc_keywords_0_keywords_lc_score_idx ON docs.doc_keywords_0 USING btree (keywords_lc, keyword_score, keyword_tokens, doc_id)'
+db_exec 'CREATE INDEX doc_meta_0_pub_date_doc_id_idx ON docs.doc_meta_0 USING btree (pub_date, doc_id)'
 
 echo 'Unzip ngrams (~12 hours / 12 = 1 hour)'
 unzip -p ~/data/GeneralIndex.ngrams.0/doc_ngrams_0.sql.zip | head -n 1850415729 | tqdm --dynamic-ncols --smoothing 0 --unit-scale --total 1850415729 | psql $DB_URL
+add_doc_ids doc_ngrams_0
 
 echo 'Create indices for ngrams'
 
-db_exec 'CREATE INDEX doc_ngrams_0_dkey_idx ON docs.doc_ngrams_0 USING btree (dkey)'
+db_exec 'CREATE INDEX doc_ngrams_0_doc_id_idx ON docs.doc_ngrams_0 USING btree (doc_id)'
 db_exec 'CREATE INDEX doc_ngrams_0_ngram_lc_idx ON docs.doc_ngrams_0 USING btree (ngram_lc)'
 
 echo 'Analyze'
@@ -40,6 +40,7 @@ SET default_table_access_method = heap;
 --
 
 CREATE TABLE docs.doc_keywords_0 (
+    doc_id integer,
     dkey text,
     keywords text,
     keywords_lc text,
@@ -52,12 +53,26 @@ CREATE TABLE docs.doc_keywords_0 (
 
 ALTER TABLE docs.doc_keywords_0 OWNER TO roger;
 
+--
+-- Name: doc_keyword_postings_0; Type: TABLE; Schema: docs; Owner: roger
+--
+
+CREATE TABLE docs.doc_keyword_postings_0 (
+    keywords_lc text NOT NULL,
+    doc_ids integer[] NOT NULL,
+    doc_freq integer NOT NULL
+);
+
+
+ALTER TABLE docs.doc_keyword_postings_0 OWNER TO roger;
+
 --
 -- Name: doc_meta_0; Type: TABLE; Schema: docs; Owner: roger
 --
 
 CREATE TABLE docs.doc_meta_0 (
     dkey text NOT NULL,
+    doc_id integer NOT NULL,
     raw_id integer,
     meta_key text,
     doc_doi text,
@@ -71,7 +86,7 @@ CREATE TABLE docs.doc_meta_0 (
     title text,
     doc_pub_date text,
     meta_pub_date text,
-    pub_date text,
+    pub_date timestamp without time zone,
     doc_author text,
     meta_author text,
     author text,
@@ -88,6 +103,7 @@ ALTER TABLE docs.doc_meta_0 OWNER TO roger;
 --
 
 CREATE TABLE docs.doc_ngrams_0 (
+    doc_id integer,
     dkey text,
     ngram text,
     ngram_lc text,
@@ -101,6 +117,47 @@ CREATE TABLE docs.doc_ngrams_0 (
 
 ALTER TABLE docs.doc_ngrams_0 OWNER TO roger;
 
+--
+-- Name: combine_task; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.combine_task (
+    id integer NOT NULL,
+    created timestamp without time zone NOT NULL,
+    start_time timestamp without time zone,
+    end_time timestamp without time zone,
+    operation text NOT NULL,
+    user_id integer NOT NULL,
+    left_dataset_id integer NOT NULL,
+    right_dataset_id integer NOT NULL,
+    dataset_id integer
+);
+
+
+ALTER TABLE public.combine_task OWNER TO postgres;
+
+--
+-- Name: combine_task_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.combine_task_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.combine_task_id_seq OWNER TO postgres;
+
+--
+-- Name: combine_task_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: postgres
+--
+
+ALTER SEQUENCE public.combine_task_id_seq OWNED BY public.combine_task.id;
+
+
 --
 -- Name: dataset; Type: TABLE; Schema: public; Owner: postgres
 --
@@ -108,7 +165,10 @@ ALTER TABLE docs.doc_ngrams_0 OWNER TO roger;
 CREATE TABLE public.dataset (
     id integer NOT NULL,
     num_papers integer DEFAULT 0 NOT NULL,
-    name text DEFAULT ''::text
+    name text DEFAULT ''::text,
+    query_key text,
+    phrases_filename text,
+    phrases_fingerprint text
 );
 
 
@@ -142,7 +202,7 @@ ALTER SEQUENCE public.dataset_id_seq OWNED BY public.dataset.id;
 
 CREATE TABLE public.dataset_paper (
     dataset_id integer NOT NULL,
-    dkey text NOT NULL
+    doc_id integer NOT NULL
 );
 
 
@@ -158,6 +218,14 @@ CREATE TABLE public.filter_task (
     start_time timestamp without time zone,
     end_time timestamp without time zone,
     keywords text NOT NULL,
+    min_score double precision,
+    min_tokens integer,
+    max_tokens integer,
+    min_date timestamp without time zone,
+    max_date timestamp without time zone,
+    progress double precision DEFAULT 0 NOT NULL,
+    num_rows integer DEFAULT 0 NOT NULL,
+    cancelled boolean DEFAULT false NOT NULL,
     user_id integer NOT NULL,
     dataset_id integer
 );
@@ -250,7 +318,9 @@ CREATE TABLE public.train_task (
     end_time timestamp without time zone,
     user_id integer NOT NULL,
     dataset_id integer NOT NULL,
-    model_id integer
+    model_id integer,
+    epochs_trained integer,
+    attempts integer DEFAULT 0 NOT NULL
 );
 
 
@@ -350,6 +420,13 @@ ALTER TABLE public.user_id_seq OWNER TO postgres;
 ALTER SEQUENCE public.user_id_seq OWNED BY public."user".id;
 
 
+--
+-- Name: combine_task id; Type: DEFAULT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.combine_task ALTER COLUMN id SET DEFAULT nextval('public.combine_task_id_seq'::regclass);
+
+
 --
 -- Name: dataset id; Type: DEFAULT; Schema: public; Owner: postgres
 --
@@ -400,12 +477,36 @@ ALTER TABLE ONLY docs.doc_meta_0
     ADD CONSTRAINT doc_meta_0_pkey PRIMARY KEY (dkey);
 
 
+--
+-- Name: doc_meta_0 doc_meta_0_doc_id_key; Type: CONSTRAINT; Schema: docs; Owner: roger
+--
+
+ALTER TABLE ONLY docs.doc_meta_0
+    ADD CONSTRAINT doc_meta_0_doc_id_key UNIQUE (doc_id);
+
+
+--
+-- Name: doc_keyword_postings_0 doc_keyword_postings_0_pkey; Type: CONSTRAINT; Schema: docs; Owner: roger
+--
+
+ALTER TABLE ONLY docs.doc_keyword_postings_0
+    ADD CONSTRAINT doc_keyword_postings_0_pkey PRIMARY KEY (keywords_lc);
+
+
 --
 -- Name: dataset_paper dataset_paper_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
 ALTER TABLE ONLY public.dataset_paper
-    ADD CONSTRAINT dataset_paper_pkey PRIMARY KEY (dataset_id, dkey);
+    ADD CONSTRAINT dataset_paper_pkey PRIMARY KEY (dataset_id, doc_id);
+
+
+--
+-- Name: combine_task combine_task_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.combine_task
+    ADD CONSTRAINT combine_task_pkey PRIMARY KEY (id);
 
 
 --
@@ -416,6 +517,14 @@ ALTER TABLE ONLY public.dataset
     ADD CONSTRAINT dataset_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: dataset dataset_query_key_key; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.dataset
+    ADD CONSTRAINT dataset_query_key_key UNIQUE (query_key);
+
+
 --
 -- Name: filter_task filter_task_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -511,10 +620,56 @@ CREATE INDEX doc_keywords_0_keywords_lc_idx ON docs.doc_keywords_0 USING btree (
 
 
 --
--- Name: doc_ngrams_0_dkey_idx; Type: INDEX; Schema: docs; Owner: roger
+-- Name: doc_keywords_0_keywords_lc_score_idx; Type: INDEX; Schema: docs; Owner: roger
+--
+
+CREATE INDEX doc_keywords_0_keywords_lc_score_idx ON docs.doc_keywords_0 USING btree (keywords_lc, keyword_score, keyword_tokens, doc_id);
+
+
+--
+-- Name: doc_meta_0_pub_date_doc_id_idx; Type: INDEX; Schema: docs; Owner: roger
+--
+
+CREATE INDEX doc_meta_0_pub_date_doc_id_idx ON docs.doc_meta_0 USING btree (pub_date, doc_id);
+
+
+--
+-- Name: doc_ngrams_0_doc_id_idx; Type: INDEX; Schema: docs; Owner: roger
+--
+
+CREATE INDEX doc_ngrams_0_doc_id_idx ON docs.doc_ngrams_0 USING btree (doc_id);
+
+
+--
+-- Name: combine_task combine_task_dataset_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.combine_task
+    ADD CONSTRAINT combine_task_dataset_id_fkey FOREIGN KEY (dataset_id) REFERENCES public.dataset(id);
+
+
+--
+-- Name: combine_task combine_task_left_dataset_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.combine_task
+    ADD CONSTRAINT combine_task_left_dataset_id_fkey FOREIGN KEY (left_dataset_id) REFERENCES public.dataset(id);
+
+
+--
+-- Name: combine_task combine_task_right_dataset_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.combine_task
+    ADD CONSTRAINT combine_task_right_dataset_id_fkey FOREIGN KEY (right_dataset_id) REFERENCES public.dataset(id);
+
+
+--
+-- Name: combine_task combine_task_user_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
-CREATE INDEX doc_ngrams_0_dkey_idx ON docs.doc_ngrams_0 USING btree (dkey);
+ALTER TABLE ONLY public.combine_task
+    ADD CONSTRAINT combine_task_user_id_fkey FOREIGN KEY (user_id) REFERENCES public."user"(id);
 
 
 --
@@ -11,6 +11,7 @@ from api.config import DatabaseConfig, MailConfig, OpenAPIConfig
 from api.database import db
 from api.mail import mail
 from api.views.auth import blueprint as login_blueprint
+from api.views.combine_task import blueprint as combine_task_blueprint
 from api.views.filter_task import blueprint as filter_task_blueprint
 from api.views.healthcheck import blueprint as healthcheck_blueprint
 from api.views.register import blueprint as register_blueprint
@@ -44,6 +45,7 @@ CORS(app)
 
 api = Api(app)
 
+api.register_blueprint(combine_task_blueprint)
 api.register_blueprint(filter_task_blueprint)
 api.register_blueprint(healthcheck_blueprint)
 api.register_blueprint(login_blueprint)
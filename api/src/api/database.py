@@ -5,7 +5,17 @@ Functional requirements: FR1-12
 from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import JSON, Boolean, Column, DateTime, Float, ForeignKey, Integer, Text
+from sqlalchemy import (
+    ARRAY,
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    Text,
+)
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
@@ -24,6 +34,8 @@ class PaperModel(db.Model):
     __tablename__ = "doc_meta_0"
 
     dkey = Column(Text, primary_key=True)
+    # Dense surrogate id assigned by db/init-data.bash
+    doc_id = Column(Integer, nullable=False, unique=True)
     meta_doi = Column(Text)
     doi = Column(Text)
     doc_doi = Column(Text)
@@ -58,6 +70,7 @@ class NgramModel(db.Model):
     insert_date = Column(DateTime)
 
     dkey = Column(Text, ForeignKey("docs.doc_meta_0.dkey"), primary_key=True)
+    doc_id = Column(Integer)
 
 
 class KeywordsModel(db.Model):
@@ -72,6 +85,7 @@ class KeywordsModel(db.Model):
     __tablename__ = "doc_keywords_0"
 
     dkey = Column(Text, primary_key=True)
+    doc_id = Column(Integer)
     keywords = Column(Text, primary_key=True)
     keywords_lc = Column(Text)
     keyword_tokens = Column(Integer)
@@ -80,6 +94,24 @@ class KeywordsModel(db.Model):
     insert_date = Column(DateTime)
 
 
+class KeywordPostingModel(db.Model):
+    """
+    ORM class for the keyword posting table built by db/init-data.bash.
+
+    Holds one row per distinct keywords_lc from the keywords table, with the
+    sorted, distinct doc_ids of every paper it appears in and their count. This
+    turns a keyword filter into a primary key lookup instead of a scan over
+    doc_keywords_0.
+    """
+
+    __table_args__ = {"schema": "docs"}
+    __tablename__ = "doc_keyword_postings_0"
+
+    keywords_lc = Column(Text, primary_key=True)
+    doc_ids = Column(ARRAY(Integer).with_variant(JSON, "sqlite"), nullable=False)
+    doc_freq = Column(Integer, nullable=False)
+
+
 class UserModel(db.Model):
     __tablename__ = "user"
 
@@ -121,12 +153,20 @@ class FilterTaskModel(db.Model):
     start_time = Column(DateTime, nullable=True)
     end_time = Column(DateTime, nullable=True)
     keywords = Column(Text, nullable=False)
+    min_score = Column(Float, nullable=True)
+    min_tokens = Column(Integer, nullable=True)
+    max_tokens = Column(Integer, nullable=True)
+    min_date = Column(DateTime, nullable=True)
+    max_date = Column(DateTime, nullable=True)
+    progress = Column(Float, nullable=False, default=0.0)
+    num_rows = Column(Integer, nullable=False, default=0)
+    cancelled = Column(Boolean, nullable=False, default=False)
 
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     user = relationship("UserModel", uselist=False)
 
     dataset_id = Column(Integer, ForeignKey("dataset.id"), nullable=True)
-    dataset = relationship("DatasetModel", uselist=False, back_populates="task")
+    dataset = relationship("DatasetModel", uselist=False, back_populates="tasks")
 
     @hybrid_property
     def is_complete(self):
@@ -138,11 +178,11 @@ class FilterTaskModel(db.Model):
 
     @hybrid_property
     def is_error(self):
-        return self.dataset_id is None and self.is_complete
+        return self.dataset_id is None and self.is_complete and not self.cancelled
 
     @is_error.expression
     def is_error(cls):  # pylint: disable=no-self-argument
-        return cls.dataset_id.is_(None) & cls.is_complete
+        return cls.dataset_id.is_(None) & cls.is_complete & cls.cancelled.is_(False)
 
     # Hacks to make pylint work
     is_complete: Column
@@ -150,27 +190,115 @@ class FilterTaskModel(db.Model):
 
 
 class DatasetModel(db.Model):
+    """
+    A set of papers produced by filtering, or by combining other datasets.
+
+    Datasets are shared by every filter task with the same normalized query,
+    identified by query_key, so repeat queries reuse the existing papers. The
+    phrase model fitted on a dataset is saved to phrases_filename and reused by
+    later train tasks while the papers still match phrases_fingerprint.
+    """
+
     __tablename__ = "dataset"
 
     id = Column(Integer, primary_key=True)
     name = Column(Text, nullable=False)
     num_papers = Column(Integer, nullable=False)
+    query_key = Column(Text, nullable=True, unique=True)
+    phrases_filename = Column(Text, nullable=True)
+    phrases_fingerprint = Column(Text, nullable=True)
+
+    tasks = relationship("FilterTaskModel", back_populates="dataset")
+    combine_tasks = relationship(
+        "CombineTaskModel",
+        back_populates="dataset",
+        foreign_keys="CombineTaskModel.dataset_id",
+    )
 
-    task = relationship("FilterTaskModel", uselist=False, back_populates="dataset")
+    @classmethod
+    def is_owned_by(cls, user_id: int):
+        """
+        Whether a dataset was produced by one of the user's filter or combine
+        tasks
+        """
+        return cls.tasks.any(FilterTaskModel.user_id == user_id) | (
+            cls.combine_tasks.any(CombineTaskModel.user_id == user_id)
+        )
 
 
 class DatasetPaperModel(db.Model):
-    """Association table for dataset-paper relation"""
+    """
+    Association table for dataset-paper relation.
+
+    Papers are referenced by their integer doc_id, so each row is two integers
+    and joins against the docs tables compare integers instead of dkeys.
+    """
 
     __tablename__ = "dataset_paper"
 
     dataset_id = Column(
         Integer, ForeignKey("dataset.id"), nullable=False, primary_key=True
     )
-    dkey = Column(
-        Text, ForeignKey("docs.doc_meta_0.dkey"), nullable=False, primary_key=True
+    doc_id = Column(
+        Integer, ForeignKey("docs.doc_meta_0.doc_id"), nullable=False, primary_key=True
+    )
+
+
+class CombineTaskModel(db.Model):
+    """
+    Task to build a dataset from the union, intersection or difference of two
+    existing datasets
+    """
+
+    __tablename__ = "combine_task"
+
+    id = Column(Integer, primary_key=True)
+    created = Column(DateTime, nullable=False, default=datetime.utcnow)
+    start_time = Column(DateTime, nullable=True)
+    end_time = Column(DateTime, nullable=True)
+    operation = Column(Text, nullable=False)
+
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    user = relationship("UserModel", uselist=False)
+
+    left_dataset_id = Column(Integer, ForeignKey("dataset.id"), nullable=False)
+    left_dataset = relationship(
+        "DatasetModel", uselist=False, foreign_keys=[left_dataset_id]
+    )
+
+    right_dataset_id = Column(Integer, ForeignKey("dataset.id"), nullable=False)
+    right_dataset = relationship(
+        "DatasetModel", uselist=False, foreign_keys=[right_dataset_id]
     )
 
+    dataset_id = Column(Integer, ForeignKey("dataset.id"), nullable=True)
+    dataset = relationship(
+        "DatasetModel",
+        uselist=False,
+        back_populates="combine_tasks",
+        foreign_keys=[dataset_id],
+    )
+
+    @hybrid_property
+    def is_complete(self):
+        return self.end_time is not None
+
+    @is_complete.expression
+    def is_complete(cls):  # pylint: disable=no-self-argument
+        return cls.end_time.isnot(None)
+
+    @hybrid_property
+    def is_error(self):
+        return self.dataset_id is None and self.is_complete
+
+    @is_error.expression
+    def is_error(cls):  # pylint: disable=no-self-argument
+        return cls.dataset_id.is_(None) & cls.is_complete
+
+    # Hacks to make pylint work
+    is_complete: Column
+    is_error: Column
+
 
 class TrainTaskModel(db.Model):
     __tablename__ = "train_task"
@@ -180,6 +308,10 @@ class TrainTaskModel(db.Model):
     created = Column(DateTime, nullable=False, default=datetime.utcnow)
     start_time = Column(DateTime, nullable=True)
     end_time = Column(DateTime, nullable=True)
+    # Fewer than epochs_to_train if training stopped early
+    epochs_trained = Column(Integer, nullable=True)
+    # Times the task was started, including runs interrupted by the worker dying
+    attempts = Column(Integer, nullable=False, default=0)
 
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     user = relationship("UserModel", uselist=False)
@@ -0,0 +1,495 @@
+"""
+Boolean keyword queries for filter tasks.
+
+A query is a keyword phrase, or several phrases combined with AND, OR, NOT and
+parentheses, e.g. `back pain AND (spine OR neck) AND NOT cancer`. Operators
+must be upper case; consecutive words are one phrase, and a phrase can be
+double quoted to use an operator word in it.
+
+Queries can be narrowed with PaperFilters. Keyword score and token count
+limits apply to every keyword in the query, and publication date limits apply
+to the papers it matches.
+
+Functional requirements: FR5
+"""
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy.orm.session import Session
+
+from api.database import (
+    FilterTaskModel,
+    KeywordPostingModel,
+    KeywordsModel,
+    NgramModel,
+    PaperModel,
+)
+
+OPERATORS = {"AND", "OR", "NOT"}
+# A lone " is a token of its own, so that an unmatched quote is an error
+TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"|"|[^\s()"]+')
+# Sets of up to this many papers are sent to the database to look up, rather
+# than fetching every paper that matches and intersecting in Python
+MAX_LOOKUP_SIZE = 10000
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class Term:
+    def __init__(self, keywords_lc: str):
+        self.keywords_lc = keywords_lc
+
+    def terms(self) -> set[str]:
+        return {self.keywords_lc}
+
+    def canonical(self) -> str:
+        return json.dumps(self.keywords_lc)
+
+    def is_bounded(self) -> bool:
+        return True
+
+
+class And:
+    def __init__(self, children: list):
+        self.children = children
+
+    def terms(self) -> set[str]:
+        return set().union(*(child.terms() for child in self.children))
+
+    def canonical(self) -> str:
+        return _canonical_operands(And, "AND", self.children)
+
+    def is_bounded(self) -> bool:
+        return any(child.is_bounded() for child in self.children)
+
+
+class Or:
+    def __init__(self, children: list):
+        self.children = children
+
+    def terms(self) -> set[str]:
+        return set().union(*(child.terms() for child in self.children))
+
+    def canonical(self) -> str:
+        return _canonical_operands(Or, "OR", self.children)
+
+    def is_bounded(self) -> bool:
+        return all(child.is_bounded() for child in self.children)
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def terms(self) -> set[str]:
+        return self.child.terms()
+
+    def canonical(self) -> str:
+        return f"NOT {self.child.canonical()}"
+
+    def is_bounded(self) -> bool:
+        return False
+
+
+def _canonical_operands(operator_type: type, operator: str, children: list) -> str:
+    """
+    Canonical form of an associative, commutative and idempotent operator, so
+    that e.g. `b AND (a AND b)` and `a AND b` have the same form
+    """
+    operands = _flatten_operands(operator_type, children)
+    if len(operands) == 1:
+        return operands.pop()
+    return "(" + f" {operator} ".join(sorted(operands)) + ")"
+
+
+def _flatten_operands(operator_type: type, children: list) -> set[str]:
+    operands = set()
+    for child in children:
+        if isinstance(child, operator_type):
+            operands |= _flatten_operands(operator_type, child.children)
+        else:
+            operands.add(child.canonical())
+    return operands
+
+
+@dataclass
+class PaperFilters:
+    """
+    Optional limits on the keyword rows and papers a query matches
+    """
+
+    min_score: float | None = None
+    min_tokens: int | None = None
+    max_tokens: int | None = None
+    min_date: datetime | None = None
+    max_date: datetime | None = None
+
+    @classmethod
+    def from_task(cls, task: FilterTaskModel):
+        return cls(
+            min_score=task.min_score,
+            min_tokens=task.min_tokens,
+            max_tokens=task.max_tokens,
+            min_date=task.min_date,
+            max_date=task.max_date,
+        )
+
+    @property
+    def has_keyword_filters(self) -> bool:
+        return any(
+            limit is not None
+            for limit in [self.min_score, self.min_tokens, self.max_tokens]
+        )
+
+    @property
+    def has_date_filters(self) -> bool:
+        return self.min_date is not None or self.max_date is not None
+
+    def canonical(self) -> str:
+        return json.dumps(
+            {
+                "min_score": self.min_score,
+                "min_tokens": self.min_tokens,
+                "max_tokens": self.max_tokens,
+                "min_date": self.min_date and self.min_date.isoformat(),
+                "max_date": self.max_date and self.max_date.isoformat(),
+            },
+            sort_keys=True,
+        )
+
+
+def normalize_phrase(phrase: str) -> str:
+    return " ".join(phrase.lower().split())
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.tokens = TOKEN_PATTERN.findall(text)
+        if '"' in self.tokens:
+            raise QuerySyntaxError("Unmatched '\"'")
+        self.position = 0
+
+    def peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self) -> str:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"Unexpected '{self.peek()}'")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_unary()]
+        while self.peek() == "AND":
+            self.take()
+            children.append(self.parse_unary())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_unary(self):
+        if self.peek() == "NOT":
+            self.take()
+            return Not(self.parse_unary())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token is None:
+            raise QuerySyntaxError("Unexpected end of query")
+        if token == "(":
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise QuerySyntaxError("Missing ')'")
+            self.take()
+            return node
+        if token.startswith('"'):
+            phrase = normalize_phrase(self.take()[1:-1])
+            if not phrase:
+                raise QuerySyntaxError("Empty phrase")
+            return Term(phrase)
+
+        words = []
+        while self.peek() is not None and self.peek() not in {"(", ")", *OPERATORS}:
+            if self.peek().startswith('"'):
+                break
+            words.append(self.take())
+        if not words:
+            raise QuerySyntaxError(f"Unexpected '{token}'")
+        return Term(normalize_phrase(" ".join(words)))
+
+
+def parse_query(text: str):
+    """
+    Parse a keyword query, raising QuerySyntaxError if it is malformed or can
+    not be answered without listing every paper (e.g. `NOT pain`)
+    """
+    query = _Parser(text).parse()
+    if not query.is_bounded():
+        raise QuerySyntaxError("Query must match at least one keyword")
+    return query
+
+
+def query_key(query, filters: PaperFilters | None = None) -> str:
+    """
+    Content address of a query, which is the same for queries that only differ
+    in case, spacing, operand order or redundant nesting
+    """
+    canonical = query.canonical()
+    if filters is not None:
+        canonical += " " + filters.canonical()
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_doc_freqs(session: Session, terms: set[str]) -> dict[str, int]:
+    rows = (
+        session.query(KeywordPostingModel.keywords_lc, KeywordPostingModel.doc_freq)
+        .filter(KeywordPostingModel.keywords_lc.in_(terms))
+        .all()
+    )
+    return {keywords_lc: doc_freq for keywords_lc, doc_freq in rows}
+
+
+def get_posting(
+    session: Session, keywords_lc: str, candidates: set[int] | None = None
+) -> list[int]:
+    """
+    Get the doc_ids of all papers with the given keyword from the posting table.
+    On Postgres, the posting is intersected with the candidates, if any, in the
+    database, so that only the doc_ids that are also candidates are fetched.
+    Other databases (i.e. sqlite in tests) fetch the whole posting.
+    """
+    if candidates is not None and session.connection().dialect.name == "postgresql":
+        rows = session.execute(
+            """
+            select unnest(doc_ids) from docs.doc_keyword_postings_0
+            where keywords_lc = :keywords_lc
+            intersect
+            select unnest(cast(:candidates as integer[]))
+            """,
+            {"keywords_lc": keywords_lc, "candidates": sorted(candidates)},
+        )
+        return [doc_id for doc_id, in rows]
+
+    posting: KeywordPostingModel | None = (
+        session.query(KeywordPostingModel)
+        .filter_by(keywords_lc=keywords_lc)
+        .one_or_none()
+    )
+    if posting is None:
+        return []
+    return posting.doc_ids
+
+
+def get_filtered_posting(
+    session: Session,
+    keywords_lc: str,
+    filters: PaperFilters,
+    candidates: set[int] | None = None,
+) -> list[int]:
+    """
+    Get the doc_ids of all papers with the given keyword within the filters'
+    keyword score and token count limits, and among the candidates if any.
+    This is a range scan over the
+    (keywords_lc, keyword_score, keyword_tokens, doc_id) index on doc_keywords_0.
+    """
+    query = session.query(KeywordsModel.doc_id).filter(
+        KeywordsModel.keywords_lc == keywords_lc
+    )
+    if candidates is not None:
+        query = query.filter(KeywordsModel.doc_id.in_(sorted(candidates)))
+    if filters.min_score is not None:
+        query = query.filter(KeywordsModel.keyword_score >= filters.min_score)
+    if filters.min_tokens is not None:
+        query = query.filter(KeywordsModel.keyword_tokens >= filters.min_tokens)
+    if filters.max_tokens is not None:
+        query = query.filter(KeywordsModel.keyword_tokens <= filters.max_tokens)
+    return [doc_id for doc_id, in query.distinct()]
+
+
+def filter_dates(
+    session: Session, doc_ids: set[int], filters: PaperFilters
+) -> set[int]:
+    """
+    Keep the papers published within the filters' date limits.
+
+    Up to MAX_LOOKUP_SIZE papers are looked up by doc_id. More papers than
+    that are matched against an index-only range scan over the
+    (pub_date, doc_id) index on doc_meta_0 instead, which reads the papers in
+    the date range without visiting the table.
+    """
+    query = session.query(PaperModel.doc_id)
+    if filters.min_date is not None:
+        query = query.filter(PaperModel.pub_date >= filters.min_date)
+    if filters.max_date is not None:
+        query = query.filter(PaperModel.pub_date <= filters.max_date)
+
+    if len(doc_ids) <= MAX_LOOKUP_SIZE:
+        query = query.filter(PaperModel.doc_id.in_(sorted(doc_ids)))
+        return {doc_id for doc_id, in query}
+    return {doc_id for doc_id, in query.yield_per(MAX_LOOKUP_SIZE) if doc_id in doc_ids}
+
+
+def estimate(query, doc_freqs: dict[str, int]) -> int | None:
+    """
+    Upper bound on the number of papers matching a query, or None if the query
+    is unbounded
+    """
+    if isinstance(query, Term):
+        return doc_freqs.get(query.keywords_lc, 0)
+    if isinstance(query, And):
+        estimates = [estimate(child, doc_freqs) for child in query.children]
+        return min(
+            (estimate_ for estimate_ in estimates if estimate_ is not None),
+            default=None,
+        )
+    if isinstance(query, Or):
+        estimates = [estimate(child, doc_freqs) for child in query.children]
+        if None in estimates:
+            return None
+        return sum(estimates)
+    return None
+
+
+def estimate_table_rows(session: Session, model) -> int:
+    """
+    Number of rows in a table. On Postgres this comes from the planner
+    statistics kept by ANALYZE, which is instant where counting is not.
+    """
+    if session.connection().dialect.name == "postgresql":
+        table = model.__table__
+        reltuples = session.execute(
+            "select reltuples from pg_class where oid = cast(:name as regclass)",
+            {"name": f"{table.schema}.{table.name}"},
+        ).scalar()
+        return max(int(reltuples), 0)
+    return session.query(model).count()
+
+
+def estimate_dataset(session: Session, query) -> tuple[int, int]:
+    """
+    Estimate the number of papers, and of ngram rows in those papers, that a
+    query would produce, without evaluating it. Papers are an upper bound from
+    the keyword document frequencies, and ngrams scale that by the average
+    ngram rows per paper.
+    """
+    num_papers = estimate(query, get_doc_freqs(session, query.terms())) or 0
+    paper_rows = estimate_table_rows(session, PaperModel)
+    if paper_rows == 0:
+        return num_papers, 0
+    num_papers = min(num_papers, paper_rows)
+    ngram_rows = estimate_table_rows(session, NgramModel)
+    return num_papers, round(num_papers * ngram_rows / paper_rows)
+
+
+class QueryPlanner:
+    """
+    Evaluates a keyword query over the posting table.
+
+    Conjunctions are evaluated from the most selective child to the least, and
+    each child only keeps papers that survived the children before it, so a
+    narrow keyword cuts down the broad ones early. Terms without a posting are
+    known to be empty up front, and evaluation stops as soon as a conjunction
+    has no papers left.
+
+    on_step is called with the fraction of the steps done, i.e. postings
+    fetched and the date filter, after each step. Steps that turn out to be
+    unnecessary are skipped, so it may never be called with 1.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        query,
+        filters: PaperFilters | None = None,
+        on_step: Callable[[float], None] | None = None,
+    ):
+        self.session = session
+        self.query = query
+        self.filters = filters or PaperFilters()
+        self.doc_freqs = get_doc_freqs(session, query.terms())
+        self.on_step = on_step
+        self.num_steps = len(query.terms()) + int(self.filters.has_date_filters)
+        self.steps_done = 0
+
+    def execute(self) -> list[int]:
+        result = self._evaluate(self.query, None)
+        if result and self.filters.has_date_filters:
+            result = filter_dates(self.session, result, self.filters)
+            self._step()
+        return sorted(result)
+
+    def _step(self):
+        self.steps_done += 1
+        if self.on_step is not None:
+            self.on_step(min(self.steps_done / self.num_steps, 1.0))
+
+    def _evaluate(self, query, candidates: set[int] | None) -> set[int]:
+        if isinstance(query, Term):
+            return self._evaluate_term(query, candidates)
+        if isinstance(query, And):
+            return self._evaluate_and(query, candidates)
+        if isinstance(query, Or):
+            result = set()
+            for child in query.children:
+                result |= self._evaluate(child, candidates)
+            return result
+        # Negations are only evaluated against the candidates of an enclosing
+        # conjunction, which parse_query guarantees exist
+        assert candidates is not None
+        return candidates - self._evaluate(query.child, candidates)
+
+    def _evaluate_term(self, term: Term, candidates: set[int] | None) -> set[int]:
+        if self.doc_freqs.get(term.keywords_lc, 0) == 0:
+            return set()
+        if candidates is not None and not candidates:
+            return set()
+        # Few candidates are looked up instead of fetching the whole posting
+        lookup = (
+            candidates
+            if candidates is not None and len(candidates) <= MAX_LOOKUP_SIZE
+            else None
+        )
+        if self.filters.has_keyword_filters:
+            posting = get_filtered_posting(
+                self.session, term.keywords_lc, self.filters, lookup
+            )
+        else:
+            posting = get_posting(self.session, term.keywords_lc, lookup)
+        self._step()
+        if candidates is None:
+            return set(posting)
+        return candidates.intersection(posting)
+
+    def _evaluate_and(self, query: And, candidates: set[int] | None) -> set[int]:
+        # Cheapest first, with unbounded children (e.g. `NOT a`) last since
+        # they can only remove papers found by the others
+        def cost(child):
+            estimate_ = estimate(child, self.doc_freqs)
+            return (estimate_ is None, estimate_ or 0)
+
+        for child in sorted(query.children, key=cost):
+            candidates = self._evaluate(child, candidates)
+            if not candidates:
+                return set()
+        return candidates
@@ -11,3 +11,4 @@ class DatasetSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = DatasetModel
         include_fk = True
+        exclude = ("phrases_filename", "phrases_fingerprint")
@@ -0,0 +1,103 @@
+"""
+Functional requirements: FR5,6
+"""
+
+from http import HTTPStatus
+from typing import Any
+
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from marshmallow import Schema, fields, validate
+from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
+
+from api.authentication import auth
+from api.database import CombineTaskModel, DatasetModel, db
+from api.schemas import DatasetSchema
+
+blueprint = Blueprint("combine-task", "combine-task", url_prefix="/combine-task")
+
+
+class CombinePostSchema(Schema):
+    operation = fields.Str(
+        required=True, validate=validate.OneOf(["union", "intersection", "difference"])
+    )
+    left_dataset_id = fields.Int(required=True)
+    right_dataset_id = fields.Int(required=True)
+
+
+class CombineListSchema(Schema):
+    is_complete = fields.Bool()
+    is_error = fields.Bool()
+
+
+class CombineTaskSchema(SQLAlchemyAutoSchema):
+    class Meta:
+        model = CombineTaskModel
+        include_fk = True
+
+    is_complete = fields.Bool()
+    is_error = fields.Bool()
+
+    dataset = fields.Nested(DatasetSchema, allow_none=True)
+
+
+@blueprint.route("")
+class CombineTask(MethodView):
+    @blueprint.arguments(CombinePostSchema, location="json")
+    @blueprint.response(HTTPStatus.CREATED, CombineTaskSchema)
+    @blueprint.alt_response(HTTPStatus.NOT_FOUND)
+    def post(self, args: dict[str, Any]):
+        datasets = []
+        for dataset_id in [args["left_dataset_id"], args["right_dataset_id"]]:
+            dataset = (
+                db.session.query(DatasetModel)
+                .filter(DatasetModel.is_owned_by(auth.user.id))
+                .filter(DatasetModel.id == dataset_id)
+                .one_or_none()
+            )
+            if dataset is None:
+                abort(HTTPStatus.NOT_FOUND)
+            datasets.append(dataset)
+
+        left_dataset, right_dataset = datasets
+        task = CombineTaskModel(
+            operation=args["operation"],
+            left_dataset=left_dataset,
+            right_dataset=right_dataset,
+            user=auth.user,
+        )
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    @blueprint.arguments(CombineListSchema, location="query")
+    @blueprint.response(HTTPStatus.OK, CombineTaskSchema(many=True))
+    def get(self, args: dict[str, Any]):
+        is_complete = args.get("is_complete")
+        is_error = args.get("is_error")
+
+        query = db.session.query(CombineTaskModel).filter_by(user_id=auth.user.id)
+
+        if is_complete is not None:
+            query = query.filter(CombineTaskModel.is_complete.is_(is_complete))
+        if is_error is not None:
+            query = query.filter(CombineTaskModel.is_error.is_(is_error))
+
+        return query.all()
+
+
+@blueprint.route("/<int:combine_task_id>")
+class CombineTaskById(MethodView):
+    @blueprint.response(HTTPStatus.OK, CombineTaskSchema)
+    @blueprint.alt_response(HTTPStatus.NOT_FOUND)
+    def get(self, combine_task_id: int):
+        combine_task = (
+            db.session.query(CombineTaskModel)
+            .filter_by(user_id=auth.user.id)
+            .filter_by(id=combine_task_id)
+            .one_or_none()
+        )
+        if combine_task is None:
+            abort(HTTPStatus.NOT_FOUND)
+
+        return combine_task
@@ -2,16 +2,24 @@
 Functional requirements: FR5,6
 """
 
+from datetime import datetime, timezone
 from http import HTTPStatus
 from typing import Any
 
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields, validates, validates_schema
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 
 from api.authentication import auth
-from api.database import FilterTaskModel, db
+from api.database import DatasetModel, FilterTaskModel, db
+from api.keyword_query import (
+    PaperFilters,
+    QuerySyntaxError,
+    estimate_dataset,
+    parse_query,
+    query_key,
+)
 from api.schemas import DatasetSchema
 
 blueprint = Blueprint("filter-task", "filter-task", url_prefix="/filter-task")
@@ -19,6 +27,31 @@ blueprint = Blueprint("filter-task", "filter-task", url_prefix="/filter-task")
 
 class FilterPostSchema(Schema):
     keywords = fields.List(fields.Str(), required=True)
+    min_score = fields.Float(load_default=None)
+    min_tokens = fields.Int(load_default=None)
+    max_tokens = fields.Int(load_default=None)
+    # Dates with an offset are converted to naive UTC, like pub_date
+    min_date = fields.NaiveDateTime(timezone=timezone.utc, load_default=None)
+    max_date = fields.NaiveDateTime(timezone=timezone.utc, load_default=None)
+
+    @validates("keywords")
+    def validate_keywords(self, keywords: list[str]):
+        try:
+            parse_query(" ".join(keywords))
+        except QuerySyntaxError as error:
+            raise ValidationError(str(error)) from error
+
+    @validates_schema
+    def validate_ranges(self, data: dict[str, Any], **_kwargs):
+        for low, high in [("min_tokens", "max_tokens"), ("min_date", "max_date")]:
+            if data.get(low) is not None and data.get(high) is not None:
+                if data[low] > data[high]:
+                    raise ValidationError(f"{low} must not be after {high}", low)
+
+
+class FilterEstimateSchema(Schema):
+    num_papers = fields.Int()
+    num_ngrams = fields.Int()
 
 
 class FilterListSchema(Schema):
@@ -44,7 +77,26 @@ class FilterTask(MethodView):
     def post(self, args: dict[str, Any]):
         keywords: list[str] = args["keywords"]
 
-        task = FilterTaskModel(keywords=" ".join(keywords), user=auth.user)
+        task = FilterTaskModel(
+            keywords=" ".join(keywords),
+            min_score=args["min_score"],
+            min_tokens=args["min_tokens"],
+            max_tokens=args["max_tokens"],
+            min_date=args["min_date"],
+            max_date=args["max_date"],
+            user=auth.user,
+        )
+
+        # Link to the dataset from an earlier run of the same query if there is
+        # one, completing the task without running the filter again
+        key = query_key(parse_query(task.keywords), PaperFilters.from_task(task))
+        dataset = db.session.query(DatasetModel).filter_by(query_key=key).one_or_none()
+        if dataset is not None:
+            task.dataset = dataset
+            task.progress = 1.0
+            task.num_rows = dataset.num_papers
+            task.start_time = task.end_time = datetime.utcnow()
+
         db.session.add(task)
         db.session.commit()
         return task
@@ -65,6 +117,21 @@ class FilterTask(MethodView):
         return query.all()
 
 
+@blueprint.route("/estimate")
+class FilterEstimate(MethodView):
+    @blueprint.arguments(FilterPostSchema, location="query")
+    @blueprint.response(HTTPStatus.OK, FilterEstimateSchema)
+    def get(self, args: dict[str, Any]):
+        """
+        Estimate the size of the dataset a filter task would produce, so broad
+        queries can be refined before they are run. Filters other than the
+        keywords are not taken into account.
+        """
+        query = parse_query(" ".join(args["keywords"]))
+        num_papers, num_ngrams = estimate_dataset(db.session, query)
+        return {"num_papers": num_papers, "num_ngrams": num_ngrams}
+
+
 @blueprint.route("/<int:filter_task_id>")
 class FilterTaskById(MethodView):
     @blueprint.response(HTTPStatus.OK, FilterTaskSchema)
@@ -80,3 +147,37 @@ class FilterTaskById(MethodView):
             abort(HTTPStatus.NOT_FOUND)
 
         return filter_task
+
+
+@blueprint.route("/<int:filter_task_id>/cancel")
+class CancelFilterTask(MethodView):
+    @blueprint.response(HTTPStatus.OK, FilterTaskSchema)
+    @blueprint.alt_response(HTTPStatus.NOT_FOUND)
+    @blueprint.alt_response(HTTPStatus.CONFLICT)
+    def post(self, filter_task_id: int):
+        filter_task: FilterTaskModel = (
+            db.session.query(FilterTaskModel)
+            .filter_by(user_id=auth.user.id)
+            .filter_by(id=filter_task_id)
+            .one_or_none()
+        )
+        if filter_task is None:
+            abort(HTTPStatus.NOT_FOUND)
+        if filter_task.is_complete:
+            abort(HTTPStatus.CONFLICT)
+
+        # A running task is stopped by the worker after its current step, but
+        # one that has not started yet is never picked up. The worker only
+        # links a dataset to a task that is not cancelled, so a task is only
+        # cancelled while it has no dataset, whichever of them commits first.
+        num_cancelled = (
+            db.session.query(FilterTaskModel)
+            .filter_by(id=filter_task.id, dataset_id=None)
+            .update({"cancelled": True})
+        )
+        if num_cancelled == 0:
+            abort(HTTPStatus.CONFLICT)
+        if filter_task.start_time is None:
+            filter_task.start_time = filter_task.end_time = datetime.utcnow()
+        db.session.commit()
+        return filter_task
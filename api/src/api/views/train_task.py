@@ -6,14 +6,16 @@ import json
 from http import HTTPStatus
 from typing import Any
 
+from flask import Response
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields, validate, validates_schema
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 
 from api.authentication import auth
-from api.database import DatasetModel, FilterTaskModel, TrainTaskModel, db
+from api.database import DatasetModel, TrainedModel, TrainTaskModel, db
 from api.schemas import DatasetSchema
+from api.word2vec.embeddings import iter_text, load_embeddings
 
 blueprint = Blueprint("train-task", "train-task", url_prefix="/train-task")
 
@@ -24,10 +26,32 @@ class HyperparameterSchema(Schema):
     learning_rate = fields.Float(required=True)
     num_neg_samples = fields.Int(required=True)
     batch_size = fields.Int(required=True)
-    concurrent_steps = fields.Int(required=True)
+    concurrent_steps = fields.Int(required=True, validate=validate.Range(min=1))
     window_size = fields.Int(required=True)
+    # Ngrams whose total count across the dataset is below min_count are
+    # dropped, so the same corpus serves every value
     min_count = fields.Int(required=True)
     subsample = fields.Float(required=True)
+    # Defaults to "keras"; "gensim" trains on concurrent_steps threads instead
+    engine = fields.Str(validate=validate.OneOf(["keras", "gensim"]))
+    # Defaults to "adam"; "sgd" only updates the embedding rows of each batch
+    optimizer = fields.Str(validate=validate.OneOf(["adam", "sgd"]))
+    # Stop once the loss on the held-out fraction of the corpus has not
+    # improved for patience epochs. Without any held-out data there is no loss
+    # to stop on.
+    validation_split = fields.Float(
+        validate=validate.Range(min=0, max=1, min_inclusive=False, max_inclusive=False)
+    )
+    patience = fields.Int(validate=validate.Range(min=1))
+
+    @validates_schema
+    def validate_engine(self, data: dict[str, Any], **_kwargs):
+        if data.get("engine") == "gensim":
+            for name in ["optimizer", "validation_split", "patience"]:
+                if name in data:
+                    raise ValidationError(
+                        f"{name} is not supported by the gensim engine", name
+                    )
 
 
 class TrainPostSchema(Schema):
@@ -60,8 +84,7 @@ class TrainTask(MethodView):
 
         dataset = (
             db.session.query(DatasetModel)
-            .join(FilterTaskModel)
-            .filter(FilterTaskModel.user_id == auth.user.id)
+            .filter(DatasetModel.is_owned_by(auth.user.id))
             .filter(DatasetModel.id == dataset_id)
         ).one()
 
@@ -104,6 +127,36 @@ class TrainTaskById(MethodView):
         return train_task
 
 
+@blueprint.route("/<int:train_task_id>/embeddings")
+class TrainTaskEmbeddings(MethodView):
+    @blueprint.response(HTTPStatus.OK)
+    @blueprint.alt_response(HTTPStatus.NOT_FOUND)
+    def get(self, train_task_id: int):
+        """
+        Download the trained embeddings in the word2vec text format
+        """
+        model = (
+            db.session.query(TrainedModel)
+            .join(TrainTaskModel)
+            .filter(TrainTaskModel.user_id == auth.user.id)
+            .filter(TrainTaskModel.id == train_task_id)
+            .one_or_none()
+        )
+        if model is None:
+            abort(HTTPStatus.NOT_FOUND)
+
+        keyed_vectors = load_embeddings(model.embeddings_filename)
+        return Response(
+            iter_text(keyed_vectors),
+            mimetype="text/plain",
+            headers={
+                "Content-Disposition": (
+                    f"attachment; filename=embeddings_{train_task_id}.txt"
+                )
+            },
+        )
+
+
 @blueprint.route("/suggest-hparams")
 class SuggestHParams(MethodView):
     @blueprint.response(HTTPStatus.OK, HyperparameterSchema)
@@ -118,4 +171,5 @@ class SuggestHParams(MethodView):
             "window_size": 5,
             "min_count": 5,
             "subsample": 1e-3,
+            "engine": "keras",
         }
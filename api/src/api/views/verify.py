@@ -12,6 +12,7 @@ from marshmallow import Schema, fields
 
 from api.authentication import auth
 from api.database import TrainedModel, TrainTaskModel, db
+from api.word2vec.embeddings import load_embeddings
 
 blueprint = Blueprint("verify", "verify", url_prefix="/verify")
 
@@ -36,7 +37,7 @@ class AnalogyTestSchema(Schema):
 
 
 def keyed_vectors_from_model(model: TrainedModel) -> KeyedVectors:
-    return KeyedVectors.load_word2vec_format(model.embeddings_filename)
+    return load_embeddings(model.embeddings_filename)
 
 
 @blueprint.route("/most-similar")
@@ -0,0 +1,144 @@
+"""
+Binary training corpus.
+
+A corpus is a directory holding a vocabulary table and the ngrams of a dataset
+as token ids, so that training reads it back with numpy.memmap instead of
+parsing and tokenizing text:
+
+- vocab.txt: one word per line, the word with token id i on line i
+- tokens.int32: the token ids of every distinct ngram, concatenated
+- offsets.int64: where each ngram starts in tokens, followed by len(tokens)
+- counts.int64: the total count of each ngram across the dataset
+
+Functional requirements: FR8
+"""
+
+import re
+from array import array
+from contextlib import ExitStack
+from pathlib import Path
+from typing import BinaryIO, Iterable, NamedTuple
+
+import numpy as np
+
+from api.word2vec.stopwords import stopwords
+
+PUNCTUATION = re.compile(r'[!"#$%&()\*\+,-\./:;<=>?@\[\\\]^`{|}~\']')
+BUFFER_SIZE = 1 << 20
+
+STOPWORDS = frozenset(stopwords)
+
+
+class Corpus(NamedTuple):
+    vocab: list[str]
+    tokens: np.ndarray
+    offsets: np.ndarray
+    counts: np.ndarray
+
+
+def tokenize(words: list[str]) -> list[str]:
+    """
+    Drop stop words and punctuation from the words of an ngram
+    """
+    tokens = (PUNCTUATION.sub("", word) for word in words if word not in STOPWORDS)
+    return [token for token in tokens if token]
+
+
+def count_ngrams(rows: Iterable[tuple[list[str], int]]) -> dict[tuple[str, ...], int]:
+    """
+    Sum the counts of (words, count) rows by the tokens of their words,
+    dropping rows left without any tokens. CorpusWriter.add_tokens takes the
+    result, so that the rows can be tokenized in several processes.
+    """
+    ngram_counts: dict[tuple[str, ...], int] = {}
+    for words, count in rows:
+        ngram = tuple(tokenize(words))
+        if ngram:
+            ngram_counts[ngram] = ngram_counts.get(ngram, 0) + count
+    return ngram_counts
+
+
+def _flush(buffers: tuple[array, ...], files: list[BinaryIO]):
+    for values, file in zip(buffers, files):
+        values.tofile(file)
+        del values[:]
+
+
+class CorpusWriter:
+    """
+    Build a corpus directory from ngrams added one at a time.
+
+    Ngrams with the same tokens, i.e. the same ngram in different papers, are
+    summed into a single row with their total count as they are added, and
+    ngrams left without any tokens are dropped. The rows are written in the
+    order they were first seen, in blocks of about buffer_size token ids.
+    """
+
+    def __init__(self, directory: Path, buffer_size: int = BUFFER_SIZE):
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.word_ids: dict[str, int] = {}
+        self.ngram_counts: dict[tuple[int, ...], int] = {}
+
+    def add(self, words: list[str], count: int):
+        self.add_tokens(tokenize(words), count)
+
+    def add_tokens(self, tokens: Iterable[str], count: int):
+        ngram = tuple(
+            self.word_ids.setdefault(token, len(self.word_ids)) for token in tokens
+        )
+        if ngram:
+            self.ngram_counts[ngram] = self.ngram_counts.get(ngram, 0) + count
+
+    def close(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with ExitStack() as stack:
+            files = [
+                stack.enter_context(open(self.directory / name, "wb"))
+                for name in ["tokens.int32", "offsets.int64", "counts.int64"]
+            ]
+            buffers = tokens, offsets, counts = array("i"), array("q", [0]), array("q")
+            num_tokens = 0
+            for ngram, count in self.ngram_counts.items():
+                tokens.extend(ngram)
+                offsets.append(num_tokens + len(tokens))
+                counts.append(count)
+                if len(tokens) >= self.buffer_size:
+                    num_tokens += len(tokens)
+                    _flush(buffers, files)
+            _flush(buffers, files)
+
+        with open(self.directory / "vocab.txt", "w", encoding="utf-8") as file:
+            file.writelines(f"{word}\n" for word in self.word_ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _memmap(filename: Path, dtype) -> np.ndarray:
+    # Empty files cannot be memory-mapped
+    if filename.stat().st_size == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r")
+
+
+def read_corpus(directory: Path) -> Corpus:
+    vocab = (directory / "vocab.txt").read_text(encoding="utf-8").split("\n")[:-1]
+    return Corpus(
+        vocab=vocab,
+        tokens=_memmap(directory / "tokens.int32", np.int32),
+        offsets=_memmap(directory / "offsets.int64", np.int64),
+        counts=_memmap(directory / "counts.int64", np.int64),
+    )
+
+
+def write_corpus(rows, directory: Path, buffer_size: int = BUFFER_SIZE):
+    """
+    Build a corpus from (ngram, count) rows of whitespace separated text
+    """
+    with CorpusWriter(directory, buffer_size) as writer:
+        for ngram, count in rows:
+            writer.add(ngram.split(), int(count))
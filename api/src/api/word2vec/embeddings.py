@@ -0,0 +1,74 @@
+"""
+Binary embeddings artifact.
+
+Trained embeddings are saved as a directory that is loaded directly, without
+parsing text:
+
+- vocab.tsv: one word and its frequency in the corpus per line, by descending
+  frequency
+- vectors.npy: the unit-normalized float32 vector of each word
+- norms.npy: the float32 length of each word's vector before normalization
+
+Embeddings from before this format are word2vec text files, which are still
+loaded. The text format is kept as an optional export.
+
+Functional requirements: FR8,9,10
+"""
+
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from gensim.models import KeyedVectors
+
+
+def save_embeddings(
+    directory: Path, words: list[str], frequencies: list[int], vectors: np.ndarray
+):
+    directory.mkdir(parents=True, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+    # Zero vectors stay zero instead of becoming nan
+    normed_vectors = vectors / np.where(norms == 0, 1, norms)[:, None]
+
+    with open(directory / "vocab.tsv", "w", encoding="utf-8") as file:
+        file.writelines(
+            f"{word}\t{frequency}\n" for word, frequency in zip(words, frequencies)
+        )
+    np.save(directory / "vectors.npy", normed_vectors)
+    np.save(directory / "norms.npy", norms)
+
+
+def load_embeddings(path: Path) -> KeyedVectors:
+    """
+    Load embeddings saved by save_embeddings, or a word2vec text file
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return KeyedVectors.load_word2vec_format(path, binary=False)
+
+    words, frequencies = [], []
+    with open(path / "vocab.tsv", encoding="utf-8") as file:
+        for line in file:
+            word, frequency = line.rstrip("\n").rsplit("\t", 1)
+            words.append(word)
+            frequencies.append(int(frequency))
+    normed_vectors = np.load(path / "vectors.npy")
+    norms = np.load(path / "norms.npy")
+
+    keyed_vectors = KeyedVectors(normed_vectors.shape[1])
+    keyed_vectors.add_vectors(words, normed_vectors * norms[:, None])
+    for word, frequency in zip(words, frequencies):
+        keyed_vectors.set_vecattr(word, "count", frequency)
+    # Similarity queries use the saved norms instead of computing them again
+    keyed_vectors.norms = norms
+    return keyed_vectors
+
+
+def iter_text(keyed_vectors: KeyedVectors) -> Iterator[str]:
+    """
+    Yield the lines of the word2vec text format for the embeddings
+    """
+    yield f"{len(keyed_vectors)} {keyed_vectors.vector_size}\n"
+    for word, vector in zip(keyed_vectors.index_to_key, keyed_vectors.vectors):
+        yield f"{word} " + " ".join([str(x) for x in vector]) + "\n"
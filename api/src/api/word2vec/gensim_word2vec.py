@@ -0,0 +1,149 @@
+"""
+Skip-gram training with gensim's multi-threaded Word2Vec, as an alternative
+engine to the Keras implementation in api.word2vec.word2vec. It reads the same
+corpus, applies the same preprocessing and saves the same embeddings.
+
+Functional Requirements: FR8
+"""
+
+import shutil
+from pathlib import Path
+from tempfile import mkdtemp
+
+import numpy as np
+from gensim.models import Word2Vec
+from logzero import logger
+
+from api.word2vec.embeddings import save_embeddings
+from api.word2vec.word2vec import (
+    SEED,
+    process_data,
+    subsampling_table,
+    word_frequencies,
+)
+
+
+def subsample(probabilities: np.ndarray, weight: float, rng) -> np.ndarray:
+    """
+    The masks of the words kept in each repetition of a sequence, whose words
+    have the given keep probabilities, with the repetitions that keep no words
+    left out
+    """
+    max_probability = probabilities.max()
+    # Round up or down at random, so that the expected number of repetitions
+    # is exactly weight * max_probability
+    repetitions = int(weight * max_probability + rng.random())
+    kept = rng.random((repetitions, len(probabilities))) < (
+        probabilities / max_probability
+    )
+    return kept[kept.any(axis=1)]
+
+
+def write_sentences(
+    sequences: np.ndarray,
+    weights: np.ndarray,
+    vocab: list[str],
+    keep_probabilities: np.ndarray,
+    filename: Path,
+) -> tuple[int, int]:
+    """
+    Write the sequences as lines of space separated words. Gensim reads the
+    file in corpus_file mode, where every worker thread reads its own part of
+    it instead of one Python thread feeding them all.
+
+    Gensim has no per-sentence weights, but writing a sequence of weight w
+    w times would make the file as large as the summed ngram counts. Instead
+    it is written about w * p times, with p the highest keep probability of
+    its words when subsampling, and each time keeps every word with its own
+    keep probability divided by p. This is the sequence repeated w times and
+    subsampled, without the repetitions that subsampling would drop entirely.
+
+    Returns the number of lines and words written.
+    """
+    rng = np.random.default_rng(SEED)
+    num_sentences, num_words = 0, 0
+    with open(filename, "w", encoding="utf-8") as file:
+        for sequence, weight in zip(sequences, weights):
+            tokens = sequence[sequence != 0]
+            for mask in subsample(keep_probabilities[tokens], weight, rng):
+                file.write(" ".join(vocab[token] for token in tokens[mask]) + "\n")
+                num_sentences += 1
+                num_words += int(mask.sum())
+    return num_sentences, num_words
+
+
+def vocab_frequencies(sequences: np.ndarray, weights: np.ndarray, vocab: list[str]):
+    frequencies = word_frequencies(sequences, weights, len(vocab))
+    return {
+        word: int(frequency)
+        for word, frequency in zip(vocab[1:], frequencies[1:])
+        if frequency
+    }
+
+
+def train(corpus_directory, embeddings_path, hparams, work_directory=None):
+    """
+    1. Process Data, as for the Keras engine
+    2. Build the vocabulary from the weighted word frequencies
+    3. Write the sentences file, subsampled as for the Keras engine
+    4. Train skip-gram with negative sampling on concurrent_steps threads, each
+       reading its own part of the sentences file
+    5. Save the word embeddings to embeddings_path
+
+    The sentences file is written to work_directory, or to a temporary
+    directory next to embeddings_path, which is removed after training.
+
+    Returns the number of epochs trained, which is always epochs_to_train.
+    """
+    sequences, weights, vocab, num_words = process_data(corpus_directory, hparams)
+
+    model = Word2Vec(
+        vector_size=hparams["embedding_size"],
+        window=hparams["window_size"],
+        # Rows below min_count were already dropped by process_data
+        min_count=1,
+        # The sentences are already subsampled
+        sample=0,
+        negative=hparams["num_neg_samples"],
+        alpha=hparams["learning_rate"],
+        workers=hparams["concurrent_steps"],
+        sg=1,
+        seed=SEED,
+    )
+    # The frequencies of the whole corpus, for the negative sampling
+    # distribution
+    model.build_vocab_from_freq(vocab_frequencies(sequences, weights, vocab))
+
+    if work_directory is None:
+        work_directory = mkdtemp(dir=Path(embeddings_path).parent)
+    work_directory = Path(work_directory)
+    work_directory.mkdir(parents=True, exist_ok=True)
+    try:
+        sentences_filename = work_directory / "sentences.txt"
+        num_sentences, num_words_written = write_sentences(
+            sequences,
+            weights,
+            vocab,
+            subsampling_table(num_words, hparams),
+            sentences_filename,
+        )
+        logger.info(
+            "Train on %d sentences of %d words per epoch",
+            num_sentences,
+            num_words_written,
+        )
+        model.train(
+            corpus_file=str(sentences_filename),
+            total_words=num_words_written,
+            epochs=hparams["epochs_to_train"],
+        )
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    save_embeddings(
+        Path(embeddings_path),
+        model.wv.index_to_key,
+        [model.wv.get_vecattr(word, "count") for word in model.wv.index_to_key],
+        model.wv.vectors,
+    )
+    return hparams["epochs_to_train"]
@@ -5,15 +5,25 @@ to fit our use case
 
 Functional Requirements: FR8
 """
+import shutil
+from pathlib import Path
+from time import perf_counter
+from typing import NamedTuple
+
 import astroid
 import numpy as np
-import pandas as pd
 import tensorflow as tf
-import tqdm
+from logzero import logger
 
-from api.word2vec.stopwords import stopwords
+from api.word2vec import corpus, embeddings
 
 SEED = 42
+SEQUENCE_LENGTH = 5
+# Sequences turned into examples at a time, and examples shuffled at a time
+CHUNK_SIZE = 1024
+SHUFFLE_BUFFER_SIZE = 100_000
+# Fraction of the sequences held out for early stopping if none is given
+VALIDATION_SPLIT = 0.1
 MAX_INFERRED = 500
 
 astroid.context.InferenceContext.max_inferred = MAX_INFERRED
@@ -61,144 +71,426 @@ class Word2Vec(tf.keras.Model):
         return dots
 
 
-def process_data(corpus_filename, hparams):
+def process_data(corpus_directory, hparams):
     # Read in data
-    data = read_data(corpus_filename)
+    data = read_data(corpus_directory)
     # Prepare data
-    sequences, vectorize_layer, num_words = prepare_data(data, hparams)
-    return sequences, vectorize_layer, num_words
+    sequences, weights, vocab, num_words = prepare_data(data, hparams)
+    return sequences, weights, vocab, num_words
 
 
-def read_data(corpus_filename):
-    data: pd.DataFrame = pd.read_csv(
-        corpus_filename,
-        sep="\t",
-        names=["ngram_lc", "ngram_count"],
-        dtype={"ngram_lc": str, "ngram_count": np.int32},
-    )
-    return data
+def read_data(corpus_directory):
+    return corpus.read_corpus(Path(corpus_directory))
+
 
+def renumber_tokens(data: corpus.Corpus, keep, lengths):
+    """This function numbers the tokens of the kept rows by descending
+    frequency, counting each row ngram_count times, from 1 since 0 is padding.
+    It returns the new id of every token, 0 for tokens no kept row uses, and
+    the vocab of the new ids."""
 
-def strip_punctuation(input_data):
-    punctuation = r'[!"#$%&()\*\+,-\./:;<=>?@\[\\\]^`{|}~\']'
-    return tf.strings.regex_replace(input_data, punctuation, "")
+    counts = np.asarray(data.counts)
+    tokens = np.asarray(data.tokens)
+    token_keep = np.repeat(keep, lengths)
+    frequencies = np.bincount(
+        tokens[token_keep],
+        weights=np.repeat(counts, lengths)[token_keep],
+        minlength=len(data.vocab),
+    )
+    order = np.argsort(-frequencies, kind="stable")
+    num_used = np.count_nonzero(frequencies)
+    token_ids = np.zeros(len(data.vocab), dtype=np.int64)
+    token_ids[order[:num_used]] = np.arange(1, num_used + 1)
+    vocab = [""] + [data.vocab[index] for index in order[:num_used]]
+    return token_ids, vocab
 
 
-def prepare_data(data, hparams):
+def prepare_data(data: corpus.Corpus, hparams):
     """This function processes the data by:
-    1. Drop rows that are less than min_count
-    2. Drop nan rows
-    3. Remove stop words
-    4. Duplicate rows by ngram_count
-    5. Vectorize"""
-
-    data = data.drop(data[data.ngram_count < hparams["min_count"]].index)
-    data = data.dropna()
-    data["ngram_lc"] = data["ngram_lc"].apply(
-        lambda x: " ".join([word for word in x.split() if word not in stopwords])
-    )
-    data: pd.DataFrame = data.loc[data.index.repeat(data.ngram_count)].reset_index(
-        drop=True
-    )
-    data = data.ngram_lc
-    num_words = len(data.str.split().explode().unique())
-
-    # Convert to tensorflow object
-    ngrams_tf = tf.data.Dataset.from_tensor_slices((tf.cast(data.values, tf.string)))
-
-    # Create text vectorziation layer
-    vectorize_layer = tf.keras.layers.TextVectorization(
-        standardize=strip_punctuation,
-        max_tokens=num_words,
-        split="whitespace",
-        output_mode="int",
-        output_sequence_length=5,
-    )
-    vectorize_layer.adapt(ngrams_tf)
-
-    text_vector_ds = (
-        ngrams_tf.batch(hparams["batch_size"])
-        .prefetch(tf.data.AUTOTUNE)
-        .map(vectorize_layer)
-        .unbatch()
-    )
-    sequences = list(text_vector_ds.as_numpy_iterator())
-    return sequences, vectorize_layer, num_words
-
-
-def generate_negative_skipgrams(skip_grams, num_words, hparams):
-    """This function generates negative cases for each positive skip gram"""
-
-    targets, contexts, labels = [], [], []
-    label = np.array([1] + [0] * hparams["num_neg_samples"], dtype="int64")
-    for skip_gram in tqdm.tqdm(skip_grams):
-        for target_word, context_word in skip_gram:
-            (negative_samples, _, _,) = tf.random.log_uniform_candidate_sampler(
-                true_classes=np.array([[context_word]]),
-                num_true=1,
-                num_sampled=hparams["num_neg_samples"],
-                unique=True,
-                range_max=num_words,
-                seed=SEED,
-                name="negative_sampling",
-            )
+    1. Drop rows whose total count across the dataset is less than min_count
+    2. Pad or truncate each row to SEQUENCE_LENGTH tokens
+    3. Renumber the tokens by descending frequency, keeping 0 for padding
+    4. Weight each row by its ngram_count, instead of repeating it"""
+
+    counts = np.asarray(data.counts)
+    offsets = np.asarray(data.offsets)
+    lengths = np.diff(offsets)
+    keep = counts >= hparams["min_count"]
+    token_ids, vocab = renumber_tokens(data, keep, lengths)
+
+    positions = np.arange(SEQUENCE_LENGTH)
+    mask = positions < lengths[keep][:, None]
+    sequences = np.zeros(mask.shape, dtype=np.int64)
+    token_positions = (offsets[:-1][keep][:, None] + positions)[mask]
+    sequences[mask] = token_ids[np.asarray(data.tokens)[token_positions]]
+
+    weights = counts[keep].astype(np.float64)
+    return sequences, weights, vocab, len(vocab)
+
+
+def word_frequencies(sequences, weights, num_words):
+    """The number of times each word occurs in the weighted sequences"""
+
+    return np.bincount(
+        sequences.ravel(),
+        weights=np.repeat(weights, sequences.shape[1]),
+        minlength=num_words,
+    )
+
+
+def negative_sampling_distribution(sequences, weights, num_words):
+    """The unigram distribution of the weighted sequences raised to the power
+    of 0.75, from which negative samples are drawn as in the original
+    word2vec"""
+
+    frequencies = word_frequencies(sequences, weights, num_words)
+    # Never sample padding
+    frequencies[0] = 0
+    distribution = frequencies**0.75
+    if not distribution.any():
+        distribution = np.ones(num_words)
+    return distribution / distribution.sum()
+
 
-            context = np.concatenate(([context_word], negative_samples), axis=0)
-            targets.append(target_word)
-            contexts.append(context)
-            labels.append(label)
-    return targets, contexts, labels
+def cumulative_distribution(distribution):
+    """The cumulative sums of a distribution, ending at exactly 1 so that any
+    draw from [0, 1) falls inside it"""
 
+    cdf = np.cumsum(distribution)
+    return cdf / cdf[-1]
 
-def generate_positve_skipgrams(sequences, num_words, hparams):
-    """This function loops through the sequences and generates
-    skipgrams for each of the words"""
 
-    skip_grams = []
-    sampling_table = tf.keras.preprocessing.sequence.make_sampling_table(
+def generate_negative_skipgrams(contexts, cdf, hparams, rng):
+    """This function draws negative cases for every positive skip gram at once
+    and returns the (context, negatives) rows with their labels.
+
+    Negatives are drawn by binary search in the cumulative distribution, which
+    is built once instead of by every call as Generator.choice would. Searching
+    to the right never draws words of probability 0."""
+
+    negative_samples = np.searchsorted(
+        cdf, rng.random((len(contexts), hparams["num_neg_samples"])), side="right"
+    )
+    contexts = np.concatenate([contexts[:, None], negative_samples], axis=1)
+    labels = np.zeros(contexts.shape, dtype=np.int64)
+    labels[:, 0] = 1
+    return contexts, labels
+
+
+def subsampling_table(num_words, hparams):
+    """The probability of keeping each token id when subsampling. Token ids
+    are ranked by frequency, as the Keras sampling table expects."""
+
+    return tf.keras.preprocessing.sequence.make_sampling_table(
         num_words, sampling_factor=hparams["subsample"]
     )
-    for sequence in tqdm.tqdm(sequences):
-        # Generate skipgram for each sequence
-        if len(sequence) == 0:
+
+
+def generate_positve_skipgrams(sequences, weights, num_words, hparams):
+    """This function generates the positive skipgrams of all of the padded
+    sequences at once, one window offset at a time, and returns their targets,
+    contexts and weights.
+
+    Each skipgram is weighted by the weight of its sequence times the
+    probability of keeping its target word when subsampling, which is what the
+    skipgram would contribute in expectation if the sequence was repeated and
+    subsampled weight times."""
+
+    sampling_table = subsampling_table(num_words, hparams)
+    sequence_length = sequences.shape[1]
+    window_size = min(hparams["window_size"], sequence_length - 1)
+
+    targets, contexts, rows = [], [], []
+    for offset in range(-window_size, window_size + 1):
+        if offset == 0:
             continue
-        skip_gram, _ = tf.keras.preprocessing.sequence.skipgrams(
-            sequence,
-            vocabulary_size=num_words,
-            sampling_table=sampling_table,
-            window_size=hparams["window_size"],
-            negative_samples=hparams["num_neg_samples"],
+        # Target positions whose context position is inside the sequence
+        positions = np.arange(
+            max(0, -offset), min(sequence_length, sequence_length - offset)
         )
-        skip_grams.append(skip_gram)
-    return skip_grams
+        offset_targets = sequences[:, positions]
+        offset_contexts = sequences[:, positions + offset]
+        # Padding is neither a target nor a context
+        mask = (offset_targets != 0) & (offset_contexts != 0)
+        targets.append(offset_targets[mask])
+        contexts.append(offset_contexts[mask])
+        rows.append(np.nonzero(mask)[0])
+
+    targets = np.concatenate([np.zeros(0, dtype=np.int64), *targets])
+    contexts = np.concatenate([np.zeros(0, dtype=np.int64), *contexts])
+    rows = np.concatenate([np.zeros(0, dtype=np.int64), *rows])
+    return targets, contexts, weights[rows] * sampling_table[targets]
+
+
+def count_pairs(sequences, weights, num_words, hparams):
+    """This function returns the number and the total weight of the positive
+    skipgrams of the sequences, generating them a chunk at a time"""
+
+    num_pairs, total_weight = 0, 0.0
+    for start in range(0, len(sequences), CHUNK_SIZE):
+        _, _, pair_weights = generate_positve_skipgrams(
+            sequences[start : start + CHUNK_SIZE],
+            weights[start : start + CHUNK_SIZE],
+            num_words,
+            hparams,
+        )
+        num_pairs += len(pair_weights)
+        total_weight += pair_weights.sum()
+    return num_pairs, total_weight
 
 
-def generate_training_data(sequences, num_words, hparams):
-    """This function iterates through the sequences and generates positive and
-    negative skipgrams and combines them into a tensor dataset"""
+def example_generator(sequences, weights, num_words, hparams, reshuffle):
+    """This function returns a generator of the examples of a chunk of
+    sequences at a time. With reshuffle, it visits the chunks in a new random
+    order and draws new negatives every time it is called, i.e. every epoch;
+    otherwise it generates the same examples every time."""
 
-    targets, contexts, labels = [], [], []
+    cdf = cumulative_distribution(
+        negative_sampling_distribution(sequences, weights, num_words)
+    )
+    epoch_rng = np.random.default_rng(SEED)
+
+    def generate():
+        rng = epoch_rng if reshuffle else np.random.default_rng(SEED)
+        starts = np.arange(0, len(sequences), CHUNK_SIZE)
+        for start in rng.permutation(starts):
+            targets, positive_contexts, pair_weights = generate_positve_skipgrams(
+                sequences[start : start + CHUNK_SIZE],
+                weights[start : start + CHUNK_SIZE],
+                num_words,
+                hparams,
+            )
+            contexts, labels = generate_negative_skipgrams(
+                positive_contexts, cdf, hparams, rng
+            )
+            yield (targets, contexts), labels, pair_weights.astype(np.float32)
+
+    return generate
+
+
+def generate_training_data(sequences, weights, num_words, hparams, reshuffle=True):
+    """This function combines the positive and negative skipgrams of the
+    sequences into a tensor dataset of ((target, context), label, sample
+    weight) batches. Examples are generated lazily, a chunk of sequences at a
+    time, and shuffled in a bounded buffer, so only the sequences themselves
+    are ever held in memory. Without reshuffle, e.g. for validation, every
+    epoch sees the same batches."""
+
+    # Normalize the weights to a mean of 1 so the loss keeps its usual scale.
+    # Scaling every weight alike leaves the negative sampling distribution as
+    # it is.
+    num_pairs, total_weight = count_pairs(sequences, weights, num_words, hparams)
+    if total_weight:
+        weights = weights * (num_pairs / total_weight)
+
+    num_contexts = hparams["num_neg_samples"] + 1
+    training_data = tf.data.Dataset.from_generator(
+        example_generator(sequences, weights, num_words, hparams, reshuffle),
+        output_signature=(
+            (
+                tf.TensorSpec(shape=(None,), dtype=tf.int64),
+                tf.TensorSpec(shape=(None, num_contexts), dtype=tf.int64),
+            ),
+            tf.TensorSpec(shape=(None, num_contexts), dtype=tf.int64),
+            tf.TensorSpec(shape=(None,), dtype=tf.float32),
+        ),
+    )
+    training_data = (
+        training_data.unbatch()
+        .shuffle(SHUFFLE_BUFFER_SIZE, seed=SEED, reshuffle_each_iteration=reshuffle)
+        .batch(hparams["batch_size"])
+        .prefetch(tf.data.AUTOTUNE)
+        # The number of steps per epoch is known, for the learning rate decay
+        .apply(
+            tf.data.experimental.assert_cardinality(
+                -(-num_pairs // hparams["batch_size"])
+            )
+        )
+    )
+
+    return training_data
 
-    # Generate positive skipgrams
-    positive_skip_grams = generate_positve_skipgrams(sequences, num_words, hparams)
 
-    # use the positive skipgrams to generate a negative skipgram
-    targets, contexts, labels = generate_negative_skipgrams(
-        positive_skip_grams, num_words, hparams
+class StepRateLogger(tf.keras.callbacks.Callback):
+    """Log the training steps per second of every epoch"""
+
+    def __init__(self, mode):
+        super().__init__()
+        self.mode = mode
+        self.start_time = None
+        self.steps = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start_time = perf_counter()
+        self.steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = perf_counter() - self.start_time
+        logger.info(
+            "Epoch %d ran %d steps at %.1f steps/sec in %s mode",
+            epoch + 1,
+            self.steps,
+            self.steps / elapsed if elapsed else 0.0,
+            self.mode,
+        )
+
+
+def linear_decay(learning_rate, total_steps):
+    """The learning rate decayed linearly to 0.0001 of its initial value over
+    all of training, as in the original word2vec"""
+
+    return tf.keras.optimizers.schedules.PolynomialDecay(
+        learning_rate,
+        decay_steps=max(total_steps, 1),
+        end_learning_rate=learning_rate * 0.0001,
+        power=1.0,
     )
 
-    targets = np.array(targets)
-    contexts = np.array(contexts)
-    labels = np.array(labels)
-    training_data = tf.data.Dataset.from_tensor_slices(((targets, contexts), labels))
-    training_data = training_data.shuffle(len(training_data)).batch(
-        hparams["batch_size"]
+
+def make_optimizer(hparams, total_steps):
+    """Adam by default, or plain SGD with a linearly decaying learning rate.
+    SGD only updates the embedding rows in each batch, where Adam updates its
+    moments for the whole vocabulary every step."""
+
+    if hparams.get("optimizer", "adam") == "sgd":
+        return tf.keras.optimizers.SGD(
+            learning_rate=linear_decay(hparams["learning_rate"], total_steps)
+        )
+    return tf.keras.optimizers.Adam(learning_rate=hparams["learning_rate"])
+
+
+def compile_model(word2vec, hparams, run_eagerly, total_steps):
+    """Compile the model to run op by op in eager mode, or as a graph, compiled
+    with XLA where TensorFlow was built with it"""
+
+    word2vec.compile(
+        optimizer=make_optimizer(hparams, total_steps),
+        loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True),
+        metrics=["accuracy"],
+        run_eagerly=run_eagerly,
+        jit_compile=not run_eagerly and tf.test.is_built_with_xla(),
     )
 
-    return training_data
+
+def benchmark_execution_modes(training_data, num_words, hparams, steps):
+    """Time the same training steps of a throwaway model in eager and in
+    compiled mode, and log the steps per second of each"""
+
+    batches = list(training_data.take(steps + 1))
+    if len(batches) < 2:
+        return None
+
+    rates = {}
+    for mode, run_eagerly in [("eager", True), ("compiled", False)]:
+        model = Word2Vec(num_words, hparams["embedding_size"], hparams)
+        compile_model(model, hparams, run_eagerly, len(batches))
+        # The first step traces and compiles the graph, so it is not timed
+        inputs, labels, sample_weights = batches[0]
+        model.train_on_batch(inputs, labels, sample_weight=sample_weights)
+        start_time = perf_counter()
+        for inputs, labels, sample_weights in batches[1:]:
+            model.train_on_batch(inputs, labels, sample_weight=sample_weights)
+        rates[mode] = (len(batches) - 1) / (perf_counter() - start_time)
+
+    logger.info(
+        "Training runs at %.1f steps/sec in eager mode and %.1f steps/sec in "
+        "compiled mode, %.1fx faster",
+        rates["eager"],
+        rates["compiled"],
+        rates["compiled"] / rates["eager"],
+    )
+    return rates
+
+
+def split_sequences(sequences, weights, validation_split):
+    """This function holds out a random validation_split fraction of the
+    sequences, returning the training and the held-out sequences and weights"""
+
+    order = np.random.default_rng(SEED).permutation(len(sequences))
+    num_held_out = int(len(sequences) * validation_split)
+    held_out, kept = order[:num_held_out], order[num_held_out:]
+    return (sequences[kept], weights[kept]), (sequences[held_out], weights[held_out])
+
+
+def checkpoint_callback(checkpoint_directory, vocab):
+    """Checkpoint the model weights, optimizer state and epoch at the end of
+    every epoch, and restore the last checkpoint when training starts. The
+    checkpoint is only restored if it was saved for the same vocabulary."""
+
+    vocab_filename = checkpoint_directory / "vocab.txt"
+    vocab_text = "".join(f"{word}\n" for word in vocab)
+    if checkpoint_directory.exists() and (
+        not vocab_filename.exists()
+        or vocab_filename.read_text(encoding="utf-8") != vocab_text
+    ):
+        logger.info("Discard checkpoint %s of another vocab", checkpoint_directory)
+        shutil.rmtree(checkpoint_directory)
+    checkpoint_directory.mkdir(parents=True, exist_ok=True)
+    vocab_filename.write_text(vocab_text, encoding="utf-8")
+
+    return tf.keras.callbacks.BackupAndRestore(str(checkpoint_directory / "backup"))
+
+
+class FitOptions(NamedTuple):
+    """How train fits the model, as opposed to the hyperparameters"""
+
+    # Run op by op instead of as a compiled graph, for debugging
+    run_eagerly: bool = False
+    # Steps timed in each execution mode before training, 0 to skip. Each
+    # mode builds a model of its own, so this costs memory as well as time.
+    benchmark_steps: int = 0
+    # Where every epoch is checkpointed and resumed from, if anywhere
+    checkpoint_directory: Path | None = None
+
+
+def make_datasets(sequences, weights, num_words, hparams):
+    """This function returns the training data, and the data of a held-out
+    fraction of the sequences if early stopping or a validation split is
+    asked for, or None otherwise"""
+
+    validation_split = hparams.get("validation_split")
+    if validation_split is None and hparams.get("patience") is not None:
+        validation_split = VALIDATION_SPLIT
+    if not validation_split:
+        return generate_training_data(sequences, weights, num_words, hparams), None
+
+    (sequences, weights), (held_out, held_out_weights) = split_sequences(
+        sequences, weights, validation_split
+    )
+    return (
+        generate_training_data(sequences, weights, num_words, hparams),
+        generate_training_data(
+            held_out, held_out_weights, num_words, hparams, reshuffle=False
+        ),
+    )
 
 
-def train(corpus_filename, embeddings_filename, hparams):
+def make_callbacks(hparams, vocab, options):
+    """Log the step rate of every epoch, checkpoint every epoch if there is a
+    checkpoint_directory, and stop once the held-out loss has not improved for
+    patience epochs if patience is given"""
+
+    mode = "eager" if options.run_eagerly else "compiled"
+    callbacks = [StepRateLogger(mode)]
+    if options.checkpoint_directory is not None:
+        callbacks.insert(
+            0, checkpoint_callback(Path(options.checkpoint_directory), vocab)
+        )
+    if hparams.get("patience") is not None:
+        callbacks.append(
+            tf.keras.callbacks.EarlyStopping(
+                monitor="val_loss",
+                patience=hparams["patience"],
+                restore_best_weights=True,
+            )
+        )
+    return callbacks
+
+
+def train(corpus_directory, embeddings_path, hparams, options=FitOptions()):
     """
     1. Process Data
         a. Read data
@@ -208,31 +500,51 @@ def train(corpus_filename, embeddings_filename, hparams):
         b. Generate negative skipgrams
     3. Run word2vec on training data
         a. Create a word2vec model
-        b. fit the data
-    4. Write the word embeddings to a file
+        b. fit the data, as a compiled graph unless options.run_eagerly is set
+           for debugging, resuming from the last epoch checkpointed to
+           options.checkpoint_directory, and stopping early once the held-out
+           loss has not improved for patience epochs
+    4. Save the word embeddings to embeddings_path
+
+    Returns the number of epochs trained.
     """
-    sequences, vectorize_layer, num_words = process_data(corpus_filename, hparams)
-    training_data = generate_training_data(sequences, num_words, hparams)
-    word2vec = Word2Vec(num_words, hparams["embedding_size"], hparams)
+    sequences, weights, vocab, num_words = process_data(corpus_directory, hparams)
 
-    word2vec.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=hparams["learning_rate"]),
-        loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True),
-        metrics=["accuracy"],
-        run_eagerly=True,
+    training_data, validation_data = make_datasets(
+        sequences, weights, num_words, hparams
     )
+    if options.benchmark_steps:
+        benchmark_execution_modes(
+            training_data, num_words, hparams, options.benchmark_steps
+        )
 
-    word2vec.fit(training_data, epochs=hparams["epochs_to_train"])
-
-    weights = word2vec.get_layer("w2v_embedding").get_weights()[0]
-    vocab = vectorize_layer.get_vocabulary()
+    word2vec = Word2Vec(num_words, hparams["embedding_size"], hparams)
+    compile_model(
+        word2vec,
+        hparams,
+        options.run_eagerly,
+        total_steps=int(training_data.cardinality()) * hparams["epochs_to_train"],
+    )
+    history = word2vec.fit(
+        training_data,
+        epochs=hparams["epochs_to_train"],
+        validation_data=validation_data,
+        callbacks=make_callbacks(hparams, vocab, options),
+    )
+    # Epochs are numbered from the start of training, also when resuming, and
+    # none are run if the checkpoint was saved after the last one
+    epochs_trained = (
+        history.epoch[-1] + 1 if history.epoch else hparams["epochs_to_train"]
+    )
+    logger.info("Trained %d of %d epochs", epochs_trained, hparams["epochs_to_train"])
+    if options.checkpoint_directory is not None:
+        shutil.rmtree(options.checkpoint_directory, ignore_errors=True)
+
+    # Row 0 is padding, not a word
+    vectors = word2vec.get_layer("w2v_embedding").get_weights()[0]
+    frequencies = word_frequencies(sequences, weights, num_words).astype(np.int64)
+    embeddings.save_embeddings(
+        Path(embeddings_path), vocab[1:], frequencies[1:].tolist(), vectors[1:]
+    )
 
-    with open(embeddings_filename, "w", encoding="utf-8") as out_kv:
-        for index, word in enumerate(vocab):
-            if index == 0:
-                out_kv.write(
-                    f"{vectorize_layer.vocabulary_size() - 1} "
-                    f"{hparams['embedding_size']}\n"
-                )
-                continue
-            out_kv.write(f"{word} " + " ".join([str(x) for x in weights[index]]) + "\n")
+    return epochs_trained
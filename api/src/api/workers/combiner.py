@@ -0,0 +1,59 @@
+"""
+Functional requirements: FR5
+"""
+
+from logzero import logger
+from sqlalchemy.orm.session import Session
+
+from api.database import CombineTaskModel, DatasetModel
+from api.workers.worker import Worker, WorkerRunner
+
+SET_OPERATIONS = {
+    "union": "union",
+    "intersection": "intersect",
+    "difference": "except",
+}
+
+
+class CombineWorker(Worker):
+    @property
+    def task_model(self):
+        return CombineTaskModel
+
+    def execute(self, session: Session, task: CombineTaskModel):
+        left, right = task.left_dataset, task.right_dataset
+        dataset = DatasetModel(
+            num_papers=0, name=f"({left.name}) {task.operation} ({right.name})"
+        )
+        session.add(dataset)
+        session.flush()
+
+        # The operation is one of a fixed set of keywords, never user input
+        result = session.execute(
+            f"""
+            insert into dataset_paper (dataset_id, doc_id)
+                select :dataset_id, doc_id from dataset_paper
+                where dataset_id = :left_dataset_id
+                {SET_OPERATIONS[task.operation]}
+                select :dataset_id, doc_id from dataset_paper
+                where dataset_id = :right_dataset_id
+            """,
+            {
+                "dataset_id": dataset.id,
+                "left_dataset_id": left.id,
+                "right_dataset_id": right.id,
+            },
+        )
+        logger.info(
+            "Combined datasets: inserted %s rows into dataset_paper", result.rowcount
+        )
+        dataset.num_papers = result.rowcount
+        task.dataset = dataset
+
+
+def main():
+    WorkerRunner(CombineWorker()).execute()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Functional requirements: FR8
+"""
+
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+from uuid import uuid4
+
+from logzero import logger
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*"))
+    return path.stat().st_size
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class CorpusCache:
+    """
+    Training corpora on disk, one corpus directory per key, bounded to
+    max_bytes in total.
+
+    Entries are evicted least recently used first, by modification time, which
+    is refreshed whenever an entry is read from the cache.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.root / f"corpus_{key}"
+
+    def get(self, key: str) -> Path | None:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, write: Callable[[Path], None]) -> Path:
+        """
+        Build the entry for key with write(filename), then evict other entries
+        until the cache fits in max_bytes again
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        # A partially written corpus must never be picked up by get()
+        partial_path = self.root / f"partial_{uuid4()}"
+        try:
+            write(partial_path)
+            _remove(path)
+            partial_path.replace(path)
+        finally:
+            _remove(partial_path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Path | None = None):
+        entries = sorted(
+            self.root.glob("corpus_*"), key=lambda entry: entry.stat().st_mtime
+        )
+        sizes = {entry: _size(entry) for entry in entries}
+        total_bytes = sum(sizes.values())
+        for entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            logger.info("Evict corpus %s", entry)
+            total_bytes -= sizes[entry]
+            _remove(entry)
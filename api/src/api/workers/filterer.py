@@ -5,32 +5,121 @@ Functional requirements: FR5
 from logzero import logger
 from sqlalchemy.orm.session import Session
 
-from api.database import DatasetModel, FilterTaskModel
+from api.database import DatasetModel, DatasetPaperModel, FilterTaskModel
+from api.keyword_query import PaperFilters, QueryPlanner, parse_query, query_key
 from api.workers.worker import Worker, WorkerRunner
 
+CHUNK_SIZE = 10000
+# Share of a task's progress taken up by evaluating its query, before any
+# papers are inserted
+PLANNING_PROGRESS = 0.5
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+def discard_dataset(session: Session, dataset: DatasetModel):
+    session.query(DatasetPaperModel).filter_by(dataset_id=dataset.id).delete()
+    session.delete(dataset)
+    session.commit()
+
+
+def link_dataset(session: Session, task: FilterTaskModel, dataset: DatasetModel):
+    """
+    Link a dataset to a task unless the task has been cancelled, in a single
+    update, so that a cancellation made after the last check is not lost.
+    Returns whether the dataset was linked.
+    """
+    num_linked = (
+        session.query(FilterTaskModel)
+        .filter_by(id=task.id, cancelled=False)
+        .update({"dataset_id": dataset.id, "progress": 1.0})
+    )
+    return num_linked > 0
+
 
 class FilterWorker(Worker):
+    """
+    Filters papers into a dataset in chunks of chunk_size papers.
+
+    The task's progress is committed and checked for cancellation after every
+    step of the query evaluation, and after every chunk of papers inserted. The
+    dataset is only linked to the task, and made available for reuse, once
+    every chunk is in.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
     @property
     def task_model(self):
         return FilterTaskModel
 
     def execute(self, session: Session, task: FilterTaskModel):
-        dataset = DatasetModel(task=task, num_papers=0, name=task.keywords)
+        query = parse_query(task.keywords)
+        filters = PaperFilters.from_task(task)
+        key = query_key(query, filters)
+
+        # An identical task queued before this one may have produced the dataset
+        dataset = session.query(DatasetModel).filter_by(query_key=key).one_or_none()
+        if dataset is not None:
+            logger.info("Reusing dataset %d for query %s", dataset.id, task.keywords)
+            task.dataset = dataset
+            task.progress = 1.0
+            task.num_rows = dataset.num_papers
+            return
+
+        def on_step(fraction: float):
+            task.progress = PLANNING_PROGRESS * fraction
+            # Committing expires the task, so this sees cancellations made
+            # through the API in the meantime
+            session.commit()
+            if task.cancelled:
+                raise TaskCancelled()
+
+        try:
+            doc_ids = QueryPlanner(session, query, filters, on_step).execute()
+        except TaskCancelled:
+            logger.info("Task cancelled while evaluating its query")
+            return
+
+        dataset = DatasetModel(num_papers=0, name=task.keywords)
         session.add(dataset)
-        session.flush()
-
-        result = session.execute(
-            """
-            insert into dataset_paper (dataset_id, dkey)
-                select distinct :dataset_id, dkey from docs.doc_keywords_0
-                where keywords_lc = :keywords
-            """,
-            {"dataset_id": task.dataset.id, "keywords": task.keywords},
-        )
+        session.commit()
+
+        try:
+            for start in range(0, len(doc_ids), self.chunk_size):
+                chunk = doc_ids[start : start + self.chunk_size]
+                session.execute(
+                    DatasetPaperModel.__table__.insert(),
+                    [{"dataset_id": dataset.id, "doc_id": doc_id} for doc_id in chunk],
+                )
+                task.num_rows = start + len(chunk)
+                task.progress = PLANNING_PROGRESS + (1 - PLANNING_PROGRESS) * (
+                    task.num_rows / len(doc_ids)
+                )
+                session.commit()
+
+                if task.cancelled:
+                    logger.info("Task cancelled after %d rows", task.num_rows)
+                    discard_dataset(session, dataset)
+                    return
+
+            if not link_dataset(session, task, dataset):
+                logger.info("Task cancelled after all %d rows", len(doc_ids))
+                discard_dataset(session, dataset)
+                return
+        except Exception:
+            session.rollback()
+            discard_dataset(session, dataset)
+            raise
+
         logger.info(
-            "Filtered papers: inserted %s rows into dataset_paper", result.rowcount
+            "Filtered papers: inserted %s rows into dataset_paper", len(doc_ids)
         )
-        dataset.num_papers = result.rowcount
+        dataset.num_papers = len(doc_ids)
+        dataset.query_key = key
 
 
 def main():
@@ -2,59 +2,367 @@
 Functional requirements: FR8
 """
 
+import hashlib
 import json
+import os
+import shutil
 from datetime import datetime
+from itertools import islice
+from multiprocessing import get_context
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import TYPE_CHECKING
+from typing import Any, BinaryIO, Callable, Iterator, NamedTuple
 from uuid import uuid4
 
 import numpy as np
-from gensim.models import KeyedVectors
 from gensim.models.phrases import Phraser, Phrases
+from gensim.utils import prune_vocab
 from logzero import logger
 from sklearn.manifold import TSNE
 from sqlalchemy.orm.session import Session
 
+from api import app
 from api.database import (
     DatasetModel,
     DatasetPaperModel,
     NgramModel,
     TrainedModel,
     TrainTaskModel,
+    db,
 )
-from api.word2vec import word2vec
+from api.word2vec import gensim_word2vec, word2vec
+from api.word2vec.corpus import CorpusWriter, count_ngrams
+from api.word2vec.embeddings import load_embeddings
+from api.workers.corpus_cache import CorpusCache
 from api.workers.worker import Worker, WorkerRunner
 
-if TYPE_CHECKING:
-    from sqlalchemy.orm.query import Query
+DATA_ROOT_PATH = Path(__file__).parent.parent.parent.parent / "fs"
+BATCH_SIZE = 10000
+PHRASES_PARAMS = {"min_count": 20, "threshold": 5}
+# Bump whenever write_corpus changes its output, so stale corpora are not reused
+CORPUS_VERSION = 3
+CORPUS_CACHE_BYTES = 20 * 1024**3
+
+
+class TrainOptions(NamedTuple):
+    """
+    How the train worker runs tasks, as opposed to the hyperparameters of each
+    task
+    """
+
+    data_root: Path
+    export_processes: int = 1
+    corpus_cache_bytes: int = CORPUS_CACHE_BYTES
+    # Train op by op instead of as a compiled graph, for debugging
+    run_eagerly: bool = False
+    # Steps to time the eager and compiled modes for before training, 0 to skip
+    benchmark_steps: int = 0
+
+
+def stream_ngrams(
+    session: Session,
+    dataset: DatasetModel,
+    batch_size: int = BATCH_SIZE,
+    doc_id_range: tuple[int, int] | None = None,
+) -> Iterator[list[tuple[str, int]]]:
+    """
+    Yield the (ngram_lc, ngram_count) rows of a dataset in batches of
+    batch_size, read through a server-side cursor so that only one batch is
+    held in memory at a time. doc_id_range limits the rows to papers with
+    doc_ids in an inclusive range.
+    """
+    query = (
+        session.query(NgramModel.ngram_lc, NgramModel.ngram_count)
+        .join(DatasetPaperModel, DatasetPaperModel.doc_id == NgramModel.doc_id)
+        .filter(DatasetPaperModel.dataset_id == dataset.id)
+    )
+    if doc_id_range is not None:
+        query = query.filter(DatasetPaperModel.doc_id.between(*doc_id_range))
+    rows = iter(query.yield_per(batch_size))
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def copy_ngrams(
+    session: Session,
+    dataset: DatasetModel,
+    file: BinaryIO,
+    doc_id_range: tuple[int, int] | None = None,
+):
+    """
+    Write the (ngram_lc, ngram_count) rows of a dataset to a binary file as tab
+    separated lines. On Postgres this is a single bulk COPY ... TO STDOUT that
+    never builds Python objects; other databases (i.e. sqlite in tests) stream
+    the rows instead.
+    """
+    connection = session.connection()
+    if connection.dialect.name == "postgresql":
+        range_condition = ""
+        if doc_id_range is not None:
+            low, high = doc_id_range
+            range_condition = (
+                f"and dataset_paper.doc_id between {int(low)} and {int(high)}"
+            )
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f"""
+            copy (
+                select ngram_lc, ngram_count from docs.doc_ngrams_0
+                join dataset_paper on dataset_paper.doc_id = doc_ngrams_0.doc_id
+                where dataset_paper.dataset_id = {int(dataset.id)}
+                {range_condition}
+            ) to stdout
+            """,
+            file,
+        )
+        return
 
+    for batch in stream_ngrams(session, dataset, doc_id_range=doc_id_range):
+        file.write(
+            "".join(
+                f"{ngram_lc}\t{ngram_count}\n" for ngram_lc, ngram_count in batch
+            ).encode("utf-8")
+        )
 
-DATA_ROOT_PATH = Path(__file__).parent.parent.parent.parent / "fs"
 
+def partition_doc_ids(
+    session: Session, dataset: DatasetModel, num_partitions: int
+) -> list[tuple[int, int]]:
+    """
+    Split the doc_ids of a dataset into up to num_partitions inclusive ranges
+    holding about the same number of papers each
+    """
+    rows = session.execute(
+        """
+        select min(doc_id), max(doc_id) from (
+            select doc_id, ntile(:num_partitions) over (order by doc_id) as partition
+            from dataset_paper where dataset_id = :dataset_id
+        ) as partitions
+        group by partition order by partition
+        """,
+        {"num_partitions": num_partitions, "dataset_id": dataset.id},
+    ).all()
+    return [(low, high) for low, high in rows]
+
+
+def _init_export_process():
+    # The pooled connections inherited from the parent process belong to it, so
+    # start from an empty pool without closing them
+    db.get_engine(app).dispose(close=False)
+
+
+def _export_shard(args: tuple[int, tuple[int, int], Path]):
+    """
+    Export one partition in a worker process, over its own connection. The
+    scoped db.session is not used, as a forked process would share the
+    parent's session with it.
+    """
+    dataset_id, doc_id_range, filename = args
+    with Session(bind=db.get_engine(app)) as session:
+        dataset = session.query(DatasetModel).filter_by(id=dataset_id).one()
+        with open(filename, "wb") as file:
+            copy_ngrams(session, dataset, file, doc_id_range)
+
+
+def export_shards(
+    session: Session,
+    dataset: DatasetModel,
+    filename: Path,
+    num_shards: int,
+    processes: int = 1,
+) -> list[Path]:
+    """
+    Export the ngram rows of a dataset into up to num_shards shard files next
+    to filename, one doc_id range each. With more than one process the shards
+    are exported in parallel, each by a separate process.
+    """
+    doc_id_ranges = partition_doc_ids(session, dataset, num_shards)
+    filenames = [
+        filename.with_name(f"{filename.name}.{index}.raw")
+        for index in range(len(doc_id_ranges))
+    ]
+
+    if processes > 1:
+        # End the transaction so that no connection is checked out while the
+        # worker processes are forked
+        session.commit()
+        # Worker processes inherit the app and its database configuration
+        with get_context("fork").Pool(processes, _init_export_process) as pool:
+            pool.map(
+                _export_shard,
+                [
+                    (dataset.id, doc_id_range, shard_filename)
+                    for doc_id_range, shard_filename in zip(doc_id_ranges, filenames)
+                ],
+            )
+    else:
+        for doc_id_range, shard_filename in zip(doc_id_ranges, filenames):
+            with open(shard_filename, "wb") as file:
+                copy_ngrams(session, dataset, file, doc_id_range)
+    return filenames
+
+
+def read_ngrams(
+    filenames: list[Path], batch_size: int
+) -> Iterator[list[tuple[str, str]]]:
+    """
+    Yield the (ngram_lc, ngram_count) rows written by copy_ngrams to each file
+    in batches
+    """
+    for filename in filenames:
+        with open(filename, encoding="utf-8") as file:
+            rows = (line.rstrip("\n").rsplit("\t", 1) for line in file)
+            while batch := list(islice(rows, batch_size)):
+                yield batch
+
+
+def dataset_fingerprint(
+    session: Session, dataset: DatasetModel, batch_size: int = BATCH_SIZE
+) -> str:
+    """
+    Hash the doc_ids of a dataset, together with the phrase detection
+    parameters, so that a saved phrase model is only reused for the same papers
+    """
+    digest = hashlib.sha256(json.dumps(PHRASES_PARAMS, sort_keys=True).encode())
+    doc_ids = (
+        session.query(DatasetPaperModel.doc_id)
+        .filter_by(dataset_id=dataset.id)
+        .order_by(DatasetPaperModel.doc_id)
+        .yield_per(batch_size)
+    )
+    for (doc_id,) in doc_ids:
+        digest.update(f"{doc_id},".encode())
+    return digest.hexdigest()
+
+
+def map_shards(function: Callable[[Any], Any], args: list, processes: int) -> list:
+    """
+    Apply function to each of args, in a pool of forked processes if there is
+    more than one
+    """
+    if processes <= 1:
+        return [function(arg) for arg in args]
+    with get_context("fork").Pool(processes) as pool:
+        return pool.map(function, args)
+
+
+def _learn_shard_vocab(args: tuple[Path, int]) -> Phrases:
+    filename, batch_size = args
+    phrases = Phrases(sentences=None, progress_per=1000, **PHRASES_PARAMS)
+    for batch in read_ngrams([filename], batch_size):
+        phrases.add_vocab([ngram_lc.split(" ") for ngram_lc, _ in batch])
+    return phrases
+
+
+def fit_phraser(filenames: list[Path], batch_size: int, processes: int = 1) -> Phraser:
+    """
+    Fit a phrase model to the rows of the exported shards. The vocabulary of
+    each shard is counted by one of processes processes, and the counts are
+    merged the same way Phrases.add_vocab merges the counts of each batch.
+    """
+    phrases = Phrases(sentences=None, progress_per=1000, **PHRASES_PARAMS)
+    for shard_phrases in map_shards(
+        _learn_shard_vocab,
+        [(filename, batch_size) for filename in filenames],
+        processes,
+    ):
+        phrases.corpus_word_count += shard_phrases.corpus_word_count
+        phrases.min_reduce = max(phrases.min_reduce, shard_phrases.min_reduce)
+        for word, count in shard_phrases.vocab.items():
+            phrases.vocab[word] = phrases.vocab.get(word, 0) + count
+        if len(phrases.vocab) > phrases.max_vocab_size:
+            prune_vocab(phrases.vocab, phrases.min_reduce)
+            phrases.min_reduce += 1
+    return Phraser(phrases)
+
+
+def _count_shard_ngrams(args: tuple[Path, Phraser, int]) -> dict[tuple[str, ...], int]:
+    filename, phrases_model, batch_size = args
+    return count_ngrams(
+        (phrases_model[ngram_lc.split(" ")], int(ngram_count))
+        for batch in read_ngrams([filename], batch_size)
+        for ngram_lc, ngram_count in batch
+    )
 
-def write_corpus(session: Session, dataset: DatasetModel, filename: Path):
-    with open(filename, "w", encoding="utf-8") as file:
-        query: "Query[NgramModel]" = (
-            session.query(NgramModel)
-            .join(DatasetPaperModel, DatasetPaperModel.dkey == NgramModel.dkey)
-            .filter(DatasetPaperModel.dataset_id == dataset.id)
-            .all()
-        )
 
-        phrases = Phrases(sentences=None, min_count=20, threshold=5, progress_per=1000)
-        for ngram in query:
-            phrases.add_vocab([ngram.ngram_lc.split(" ")])
+def get_phraser(
+    session: Session,
+    dataset: DatasetModel,
+    filenames: list[Path],
+    options: TrainOptions,
+    batch_size: int,
+) -> Phraser:
+    """
+    Load the phrase model saved for a dataset, or fit and save a new one if the
+    dataset has none or its papers have changed since it was fitted
+    """
+    fingerprint = dataset_fingerprint(session, dataset, batch_size)
+    if (
+        dataset.phrases_filename is not None
+        and dataset.phrases_fingerprint == fingerprint
+        and Path(dataset.phrases_filename).exists()
+    ):
+        logger.info("Reuse phrase model %s", dataset.phrases_filename)
+        return Phraser.load(dataset.phrases_filename)
+
+    phrases_model = fit_phraser(filenames, batch_size, options.export_processes)
+
+    phrases_filename = options.data_root / f"phrases_{dataset.id}_{uuid4()}"
+    logger.info("Save phrase model to %s", phrases_filename)
+    phrases_model.save(str(phrases_filename))
+    if dataset.phrases_filename is not None:
+        Path(dataset.phrases_filename).unlink(missing_ok=True)
+    dataset.phrases_filename = str(phrases_filename)
+    dataset.phrases_fingerprint = fingerprint
+    session.commit()
+    return phrases_model
+
 
-        phrases_model = Phraser(phrases)
+def write_corpus(
+    session: Session,
+    dataset: DatasetModel,
+    directory: Path,
+    batch_size: int = BATCH_SIZE,
+    options: TrainOptions | None = None,
+):
+    """
+    Write the phrase merged ngrams of a dataset to a binary corpus directory.
+    With options, the rows are exported, phrase merged and tokenized by
+    options.export_processes processes, one shard each, and the phrase model is
+    saved under options.data_root and reused by later calls for the dataset.
+    """
+    processes = 1 if options is None else options.export_processes
+    shard_filenames = export_shards(
+        session, dataset, directory, num_shards=processes, processes=processes
+    )
 
-        for ngram in query:
-            processed_ngram = " ".join(phrases_model[ngram.ngram_lc.split(" ")])
-            file.write(f"{processed_ngram}\t{ngram.ngram_count}\n")
+    try:
+        # Phrase detection needs the vocabulary of the whole dataset before any
+        # line can be written, so the exported rows are streamed twice unless a
+        # saved phrase model can be reused
+        if options is None:
+            phrases_model = fit_phraser(shard_filenames, batch_size)
+        else:
+            phrases_model = get_phraser(
+                session, dataset, shard_filenames, options, batch_size
+            )
+
+        # Merge the counts in shard order, so that token ids are assigned in the
+        # same order as by a single process
+        with CorpusWriter(directory) as writer:
+            for ngram_counts in map_shards(
+                _count_shard_ngrams,
+                [(filename, phrases_model, batch_size) for filename in shard_filenames],
+                processes,
+            ):
+                for tokens, count in ngram_counts.items():
+                    writer.add_tokens(tokens, count)
+    finally:
+        for shard_filename in shard_filenames:
+            shard_filename.unlink()
 
 
 def generate_visualization(embeddings_filename: Path):
-    word_vectors = KeyedVectors.load_word2vec_format(embeddings_filename, binary=False)
+    word_vectors = load_embeddings(embeddings_filename)
 
     vectors = np.array(word_vectors.vectors)
     labels = np.array(word_vectors.index_to_key)
@@ -84,41 +392,96 @@ def save_model(
     return model
 
 
-def run_task(session: Session, task: TrainTaskModel, data_root: Path):
+def checkpoint_directory(data_root: Path, task: TrainTaskModel) -> Path:
+    return data_root / "checkpoints" / f"train_task_{task.id}"
+
+
+def run_task(session: Session, task: TrainTaskModel, options: TrainOptions):
+    data_root = options.data_root
     data_root.mkdir(exist_ok=True)
 
     hparams = json.loads(task.hparams)
-    with TemporaryDirectory() as tempdir:
-        corpus_filename = Path(tempdir) / "corpus.txt"
-        embeddings_filename = data_root / f"embeddings_{datetime.utcnow()}_{uuid4()}"
-
-        logger.info("Write corpus to %s", corpus_filename)
-        write_corpus(session, task.dataset, corpus_filename)
-        logger.info(
-            "Train with hparams %s and save embeddings to %s",
+    embeddings_filename = data_root / f"embeddings_{datetime.utcnow()}_{uuid4()}"
+
+    cache = CorpusCache(data_root / "corpus_cache", options.corpus_cache_bytes)
+    fingerprint = dataset_fingerprint(session, task.dataset)
+    key = f"{task.dataset.id}_v{CORPUS_VERSION}_{fingerprint}"
+    corpus_directory = cache.get(key)
+    if corpus_directory is None:
+        logger.info("Write corpus for cache key %s", key)
+        corpus_directory = cache.put(
+            key,
+            lambda directory: write_corpus(
+                session, task.dataset, directory, options=options
+            ),
+        )
+    else:
+        logger.info("Reuse cached corpus %s", corpus_directory)
+
+    logger.info(
+        "Train with hparams %s and save embeddings to %s",
+        hparams,
+        embeddings_filename,
+    )
+    if hparams.get("engine", "keras") == "gensim":
+        # The sentences file of a killed run is overwritten when the task
+        # resumes, or removed with the checkpoint when it is discarded
+        task.epochs_trained = gensim_word2vec.train(
+            corpus_directory,
+            embeddings_filename,
             hparams,
+            checkpoint_directory(data_root, task),
+        )
+    else:
+        task.epochs_trained = word2vec.train(
+            corpus_directory,
             embeddings_filename,
+            hparams,
+            word2vec.FitOptions(
+                run_eagerly=options.run_eagerly,
+                benchmark_steps=options.benchmark_steps,
+                checkpoint_directory=checkpoint_directory(data_root, task),
+            ),
         )
-        word2vec.train(corpus_filename, embeddings_filename, hparams)
-        logger.info("Generate visualization from %s", embeddings_filename)
-        visualization = generate_visualization(embeddings_filename)
-        save_model(session, task, embeddings_filename, visualization)
+    logger.info("Generate visualization from %s", embeddings_filename)
+    visualization = generate_visualization(embeddings_filename)
+    save_model(session, task, embeddings_filename, visualization)
 
 
 class TrainWorker(Worker):
-    def __init__(self, data_root: Path):
-        self.data_root = data_root
+    # Train tasks resume from their last epoch checkpoint
+    resumable = True
+
+    def __init__(self, options: TrainOptions):
+        self.options = options
 
     @property
     def task_model(self):
         return TrainTaskModel
 
     def execute(self, session: Session, task: TrainTaskModel):
-        run_task(session, task, self.data_root)
+        run_task(session, task, self.options)
+
+    def discard(self, task: TrainTaskModel):
+        # Weights and optimizer state of a task that will not resume
+        shutil.rmtree(
+            checkpoint_directory(self.options.data_root, task), ignore_errors=True
+        )
 
 
 def main():
-    WorkerRunner(TrainWorker(data_root=DATA_ROOT_PATH)).execute()
+    WorkerRunner(
+        TrainWorker(
+            TrainOptions(
+                data_root=DATA_ROOT_PATH,
+                export_processes=os.cpu_count(),
+                # Set TRAIN_RUN_EAGERLY=1 to debug training step by step
+                run_eagerly=os.environ.get("TRAIN_RUN_EAGERLY") == "1",
+                # Set TRAIN_BENCHMARK_STEPS=20 to compare the execution modes
+                benchmark_steps=int(os.environ.get("TRAIN_BENCHMARK_STEPS", "0")),
+            )
+        )
+    ).execute()
 
 
 if __name__ == "__main__":
@@ -16,6 +16,14 @@ from api.database import db
 
 
 class Worker(ABC):
+    # Whether tasks interrupted by the worker process dying are run again when
+    # the worker restarts, e.g. because they can resume from a checkpoint. The
+    # task models of resumable workers count their runs in an attempts column.
+    resumable = False
+    # Runs of a resumable task before it is given up on, so that a task which
+    # kills the worker process is not run again on every restart
+    max_attempts = 3
+
     @property
     @abstractmethod
     def task_model(self) -> Type[db.Model]:
@@ -25,6 +33,12 @@ class Worker(ABC):
     def execute(self, session: Session, task: db.Model):
         pass
 
+    def discard(self, task: db.Model):
+        """
+        Remove whatever a task left behind to resume from, once it has failed
+        and will not run again
+        """
+
 
 @contextmanager
 def db_session():
@@ -47,6 +61,31 @@ class WorkerRunner:
         )
         return task
 
+    def _requeue_interrupted(self, session: Session):
+        """
+        Queue again the tasks that were started but never ended, which only
+        happens if the worker process died while running them. Tasks that were
+        already run max_attempts times are ended instead.
+        """
+        model = self.worker.task_model
+        tasks = (
+            session.query(model)
+            .filter(model.start_time.isnot(None))
+            .filter(model.end_time.is_(None))
+            .all()
+        )
+        for task in tasks:
+            if task.attempts >= self.worker.max_attempts:
+                logger.info(
+                    "Give up on task %d after %d attempts", task.id, task.attempts
+                )
+                task.end_time = datetime.utcnow()
+                self.worker.discard(task)
+            else:
+                logger.info("Requeue interrupted task %d", task.id)
+                task.start_time = None
+        session.commit()
+
     def _tick(self, session: Session):
         logger.info("Get next task")
         next_task = self._get_next_task(session)
@@ -55,6 +94,8 @@ class WorkerRunner:
             return
 
         next_task.start_time = datetime.utcnow()
+        if self.worker.resumable:
+            next_task.attempts += 1
         session.commit()
 
         logger.info("Running task %d", next_task.id)
@@ -64,6 +105,7 @@ class WorkerRunner:
         except Exception:
             logger.exception("Task failed with exception")
             session.rollback()
+            self.worker.discard(next_task)
             raise
         finally:
             logger.info("Task completed or failed")
@@ -71,6 +113,10 @@ class WorkerRunner:
             session.commit()
 
     def execute(self):
+        if self.worker.resumable:
+            with db_session() as session:
+                self._requeue_interrupted(session)
+
         while True:
             with db_session() as session:
                 try:
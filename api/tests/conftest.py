@@ -97,6 +97,7 @@ def make_ngrams(doc: PaperModel, text: str):
     for ngram, count in ngram_counts.items():
         model = NgramModel(
             dkey=doc.dkey,
+            doc_id=doc.doc_id,
             ngram=ngram,
             ngram_lc=ngram.lower(),
             ngram_tokens=len(ngram.split()),
@@ -112,6 +113,7 @@ def make_ngrams(doc: PaperModel, text: str):
 def papers():
     paper1 = PaperModel(
         dkey="doc1",
+        doc_id=1,
         meta_doi="doi",
         doi="doi",
         doc_doi="doi",
@@ -127,6 +129,7 @@ def papers():
     )
     paper2 = PaperModel(
         dkey="doc2",
+        doc_id=2,
         meta_doi="doi",
         doi="doi",
         doc_doi="doi",
@@ -0,0 +1,202 @@
+"""
+Functional requirements: FR5,6
+"""
+
+from datetime import datetime
+from http import HTTPStatus
+
+import pytest
+from flask.testing import FlaskClient
+
+from api.database import (
+    CombineTaskModel,
+    DatasetModel,
+    DatasetPaperModel,
+    FilterTaskModel,
+    PaperModel,
+    UserModel,
+    db,
+)
+from api.workers.combiner import CombineWorker
+from api.workers.worker import WorkerRunner
+
+
+@pytest.fixture()
+def datasets(authorized_user: UserModel, papers: list[PaperModel]):
+    paper1, paper2 = papers
+    datasets_ = []
+    for keywords, members in [("back pain", [paper1]), ("pain", [paper1, paper2])]:
+        dataset = DatasetModel(num_papers=len(members), name=keywords)
+        task = FilterTaskModel(
+            user=authorized_user,
+            start_time=datetime.utcnow(),
+            end_time=datetime.utcnow(),
+            keywords=keywords,
+            dataset=dataset,
+        )
+        db.session.add_all([dataset, task])
+        db.session.flush()
+        db.session.add_all(
+            [
+                DatasetPaperModel(dataset_id=dataset.id, doc_id=paper.doc_id)
+                for paper in members
+            ]
+        )
+        datasets_.append(dataset)
+    db.session.commit()
+    return datasets_
+
+
+class TestCombineTask:
+    @pytest.mark.parametrize(
+        "operation,doc_ids",
+        [("union", [1, 2]), ("intersection", [1]), ("difference", [])],
+    )
+    def test_post(
+        self,
+        client: FlaskClient,
+        auth_headers: dict,
+        datasets: list[DatasetModel],
+        operation: str,
+        doc_ids: list[int],
+    ):
+        """
+        Combining two datasets builds a new dataset from their papers
+        """
+        response = client.post(
+            "/combine-task",
+            json={
+                "operation": operation,
+                "left_dataset_id": datasets[0].id,
+                "right_dataset_id": datasets[1].id,
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+        task: CombineTaskModel = (
+            db.session.query(CombineTaskModel).filter_by(id=response.json["id"]).one()
+        )
+        WorkerRunner(CombineWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        assert task.is_complete is True
+        assert task.is_error is False
+        assert task.dataset.num_papers == len(doc_ids)
+
+        members = (
+            db.session.query(DatasetPaperModel.doc_id)
+            .filter_by(dataset_id=task.dataset_id)
+            .order_by(DatasetPaperModel.doc_id)
+            .all()
+        )
+        assert [doc_id for doc_id, in members] == doc_ids
+
+    def test_post_not_owned(
+        self, client: FlaskClient, auth_headers: dict, datasets: list[DatasetModel]
+    ):
+        """
+        Only the user's own datasets can be combined
+        """
+        other_user = UserModel(
+            username="other",
+            password="",
+            email="other@example.com",
+            is_temp_password=False,
+        )
+        other_dataset = DatasetModel(num_papers=0, name="other")
+        db.session.add_all(
+            [
+                other_user,
+                other_dataset,
+                FilterTaskModel(
+                    user=other_user,
+                    start_time=datetime.utcnow(),
+                    end_time=datetime.utcnow(),
+                    keywords="other",
+                    dataset=other_dataset,
+                ),
+            ]
+        )
+        db.session.commit()
+
+        for right_dataset_id in [other_dataset.id, other_dataset.id + 1]:
+            response = client.post(
+                "/combine-task",
+                json={
+                    "operation": "union",
+                    "left_dataset_id": datasets[0].id,
+                    "right_dataset_id": right_dataset_id,
+                },
+                headers=auth_headers,
+            )
+            assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_post_invalid_operation(
+        self, client: FlaskClient, auth_headers: dict, datasets: list[DatasetModel]
+    ):
+        response = client.post(
+            "/combine-task",
+            json={
+                "operation": "xor",
+                "left_dataset_id": datasets[0].id,
+                "right_dataset_id": datasets[1].id,
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    def test_list_and_get(
+        self, client: FlaskClient, auth_headers: dict, datasets: list[DatasetModel]
+    ):
+        """
+        Combine tasks can be listed and fetched by id
+        """
+        response = client.post(
+            "/combine-task",
+            json={
+                "operation": "union",
+                "left_dataset_id": datasets[0].id,
+                "right_dataset_id": datasets[1].id,
+            },
+            headers=auth_headers,
+        )
+        task_id = response.json["id"]
+
+        response = client.get("/combine-task?is_complete=false", headers=auth_headers)
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.json) == 1
+
+        response = client.get(f"/combine-task/{task_id}", headers=auth_headers)
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["dataset"] is None
+
+        response = client.get(f"/combine-task/{task_id + 1}", headers=auth_headers)
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_train_combined(
+        self, client: FlaskClient, auth_headers: dict, datasets: list[DatasetModel]
+    ):
+        """
+        Combined datasets can be trained on
+        """
+        client.post(
+            "/combine-task",
+            json={
+                "operation": "union",
+                "left_dataset_id": datasets[0].id,
+                "right_dataset_id": datasets[1].id,
+            },
+            headers=auth_headers,
+        )
+        WorkerRunner(CombineWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+        task = db.session.query(CombineTaskModel).one()
+
+        response = client.get("/train-task/suggest-hparams", headers=auth_headers)
+        response = client.post(
+            "/train-task",
+            json={"dataset_id": task.dataset_id, "hparams": response.json},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
@@ -0,0 +1,64 @@
+"""
+Functional requirements: FR8
+"""
+
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from api.workers.corpus_cache import CorpusCache
+
+
+@pytest.fixture()
+def cache_root():
+    with TemporaryDirectory() as tempdir:
+        yield Path(tempdir) / "corpus_cache"
+
+
+class TestCorpusCache:
+    def test_get_put(self, cache_root: Path):
+        cache = CorpusCache(cache_root, max_bytes=1000)
+        assert cache.get("1_v1_abc") is None
+
+        path = cache.put("1_v1_abc", lambda filename: filename.write_text("pain\t1\n"))
+        assert cache.get("1_v1_abc") == path
+        assert path.read_text() == "pain\t1\n"
+        assert list(cache_root.iterdir()) == [path]
+
+    def test_failed_write(self, cache_root: Path):
+        """
+        A corpus that failed to be written is not cached
+        """
+        cache = CorpusCache(cache_root, max_bytes=1000)
+
+        def write(filename: Path):
+            filename.write_text("pain")
+            raise RuntimeError()
+
+        with pytest.raises(RuntimeError):
+            cache.put("1_v1_abc", write)
+        assert cache.get("1_v1_abc") is None
+        assert not list(cache_root.iterdir())
+
+    def test_evict_least_recently_used(self, cache_root: Path):
+        cache = CorpusCache(cache_root, max_bytes=25)
+        for index, key in enumerate(["a", "b"]):
+            path = cache.put(key, lambda filename: filename.write_text("x" * 10))
+            os.utime(path, (index, index))
+
+        # Reading "a" makes "b" the least recently used entry
+        cache.get("a")
+        cache.put("c", lambda filename: filename.write_text("x" * 10))
+        assert cache.get("a") is not None
+        assert cache.get("b") is None
+        assert cache.get("c") is not None
+
+    def test_keep_oversized_entry(self, cache_root: Path):
+        """
+        The entry just written is kept even if it alone exceeds max_bytes
+        """
+        cache = CorpusCache(cache_root, max_bytes=5)
+        cache.put("a", lambda filename: filename.write_text("x" * 10))
+        assert cache.get("a") is not None
@@ -12,11 +12,15 @@ from api.database import (
     DatasetModel,
     DatasetPaperModel,
     FilterTaskModel,
+    KeywordPostingModel,
     KeywordsModel,
+    NgramModel,
     PaperModel,
     UserModel,
     db,
 )
+from api.keyword_query import QueryPlanner
+from api.workers import filterer
 from api.workers.filterer import FilterWorker
 from api.workers.worker import WorkerRunner
 
@@ -26,6 +30,7 @@ def keywords(papers: list[PaperModel]):
     paper1, paper2 = papers
     keywords1 = KeywordsModel(
         dkey=paper1.dkey,
+        doc_id=paper1.doc_id,
         keywords="back pain",
         keywords_lc="back pain",
         keyword_tokens=2,
@@ -34,13 +39,20 @@ def keywords(papers: list[PaperModel]):
     )
     keywords2 = KeywordsModel(
         dkey=paper2.dkey,
+        doc_id=paper2.doc_id,
         keywords="pain",
         keywords_lc="pain",
         keyword_tokens=1,
         keyword_score=1.0,
         doc_count=1,
     )
-    db.session.add_all([keywords1, keywords2])
+    postings = [
+        KeywordPostingModel(
+            keywords_lc="back pain", doc_ids=[paper1.doc_id], doc_freq=1
+        ),
+        KeywordPostingModel(keywords_lc="pain", doc_ids=[paper2.doc_id], doc_freq=1),
+    ]
+    db.session.add_all([keywords1, keywords2, *postings])
     db.session.commit()
     return [keywords1, keywords2]
 
@@ -100,6 +112,348 @@ class TestFilterTask:
         assert len(papers) == 1
         assert papers[0].dkey == "doc1"
 
+    def test_post_no_matches(
+        self, client: FlaskClient, auth_headers: dict, papers, keywords
+    ):
+        """
+        A keyword with no posting produces an empty dataset, not an error
+        """
+        response = client.post(
+            "/filter-task", json={"keywords": ["asdf"]}, headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+        task: FilterTaskModel = (
+            db.session.query(FilterTaskModel).filter_by(id=response.json["id"]).one()
+        )
+        WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        assert task.is_error is False
+        assert task.dataset.num_papers == 0
+
+    def test_post_boolean(
+        self, client: FlaskClient, auth_headers: dict, papers, keywords
+    ):
+        """
+        Keywords can be combined with AND, OR and NOT
+        """
+        response = client.post(
+            "/filter-task",
+            json={"keywords": ["pain", "OR", "back", "pain"]},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+        task: FilterTaskModel = (
+            db.session.query(FilterTaskModel).filter_by(id=response.json["id"]).one()
+        )
+        WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        assert task.dataset.num_papers == 2
+
+    def test_post_reuses_dataset(
+        self, client: FlaskClient, auth_headers: dict, papers, keywords
+    ):
+        """
+        Posting a query that has already been filtered links the existing
+        dataset and completes immediately
+        """
+        response = client.post(
+            "/filter-task", json={"keywords": ["back pain"]}, headers=auth_headers
+        )
+        WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        response = client.post(
+            "/filter-task", json={"keywords": ["Back", "Pain"]}, headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.CREATED
+        assert response.json["is_complete"] is True
+        assert response.json["is_error"] is False
+        assert response.json["progress"] == 1.0
+        assert response.json["num_rows"] == 1
+
+        tasks = db.session.query(FilterTaskModel).all()
+        assert len(tasks) == 2
+        assert tasks[0].dataset_id == tasks[1].dataset_id
+        assert db.session.query(DatasetPaperModel).count() == 1
+
+    def test_execute_reuses_dataset(
+        self, client: FlaskClient, auth_headers: dict, papers, keywords
+    ):
+        """
+        Identical tasks queued before either has run share one dataset
+        """
+        for _ in range(2):
+            client.post(
+                "/filter-task", json={"keywords": ["pain"]}, headers=auth_headers
+            )
+        for _ in range(2):
+            WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        tasks = db.session.query(FilterTaskModel).all()
+        assert all(task.is_complete and not task.is_error for task in tasks)
+        assert all(task.progress == 1.0 for task in tasks)
+        assert tasks[0].num_rows == tasks[1].num_rows == tasks[0].dataset.num_papers
+        assert tasks[0].dataset_id == tasks[1].dataset_id
+        assert db.session.query(DatasetModel).count() == 1
+
+    def test_execute_chunks(self, authorized_user: UserModel, papers, keywords):
+        """
+        Papers are inserted in chunks, recording progress on the task
+        """
+        task = FilterTaskModel(user=authorized_user, keywords="pain OR back pain")
+        db.session.add(task)
+        db.session.commit()
+
+        WorkerRunner(FilterWorker(chunk_size=1))._tick(  # pylint: disable=W0212
+            db.session
+        )
+
+        assert task.is_error is False
+        assert task.progress == 1.0
+        assert task.num_rows == 2
+        assert task.dataset.num_papers == 2
+
+    def test_execute_cancelled(self, authorized_user: UserModel, papers, keywords):
+        """
+        A task cancelled while its query is evaluated stops after the current
+        step, before creating a dataset
+        """
+        task = FilterTaskModel(
+            user=authorized_user, keywords="pain OR back pain", cancelled=True
+        )
+        db.session.add(task)
+        db.session.commit()
+
+        FilterWorker(chunk_size=1).execute(db.session, task)
+        db.session.commit()
+
+        assert task.dataset is None
+        assert 0 < task.progress <= filterer.PLANNING_PROGRESS
+        assert task.num_rows == 0
+        assert db.session.query(DatasetModel).count() == 0
+
+    def test_execute_cancelled_inserting(
+        self, authorized_user: UserModel, papers, keywords, monkeypatch
+    ):
+        """
+        A task cancelled while papers are inserted stops after the current
+        chunk and discards its partial dataset
+        """
+        task = FilterTaskModel(user=authorized_user, keywords="pain OR back pain")
+        db.session.add(task)
+        db.session.commit()
+
+        original = QueryPlanner.execute
+
+        def execute(self):
+            doc_ids = original(self)
+            task.cancelled = True
+            return doc_ids
+
+        monkeypatch.setattr(QueryPlanner, "execute", execute)
+        FilterWorker(chunk_size=1).execute(db.session, task)
+        db.session.commit()
+
+        assert task.dataset is None
+        assert task.num_rows == 1
+        assert db.session.query(DatasetModel).count() == 0
+        assert db.session.query(DatasetPaperModel).count() == 0
+
+    def test_link_dataset_cancelled(self, authorized_user: UserModel):
+        """
+        A cancellation made after the last chunk still keeps the dataset from
+        being linked
+        """
+        dataset = DatasetModel(num_papers=0, name="")
+        task = FilterTaskModel(user=authorized_user, keywords="pain")
+        db.session.add_all([dataset, task])
+        db.session.commit()
+        db.session.query(FilterTaskModel).update({"cancelled": True})
+
+        assert filterer.link_dataset(db.session, task, dataset) is False
+        db.session.commit()
+        assert task.dataset_id is None
+
+        task.cancelled = False
+        assert filterer.link_dataset(db.session, task, dataset) is True
+        db.session.commit()
+        assert task.dataset_id == dataset.id
+
+    def test_cancel(self, client: FlaskClient, auth_headers: dict, filter_tasks):
+        """
+        Cancelling a task that has not started completes it without error
+        """
+        response = client.post(
+            f"/filter-task/{filter_tasks[0].id}/cancel", headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["cancelled"] is True
+        assert response.json["is_complete"] is True
+        assert response.json["is_error"] is False
+
+        response = client.post(
+            f"/filter-task/{filter_tasks[1].id}/cancel", headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.CONFLICT
+
+        # Running, but with its dataset already linked
+        filter_tasks[2].end_time = None
+        db.session.commit()
+        response = client.post(
+            f"/filter-task/{filter_tasks[2].id}/cancel", headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.CONFLICT
+        assert filter_tasks[2].cancelled is False
+
+        response = client.post("/filter-task/100/cancel", headers=auth_headers)
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_get_progress(self, client: FlaskClient, auth_headers: dict, filter_tasks):
+        """
+        GET /filter-task/<id> reports progress and row count
+        """
+        response = client.get(
+            f"/filter-task/{filter_tasks[0].id}", headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["progress"] == 0.0
+        assert response.json["num_rows"] == 0
+
+    @pytest.mark.parametrize(
+        "filters,num_papers",
+        [
+            ({"max_tokens": 1}, 1),
+            ({"min_tokens": 1, "max_tokens": 2}, 2),
+            ({"min_score": 2.0}, 0),
+            ({"min_date": "2000-01-01T00:00:00"}, 2),
+            ({"max_date": "2000-01-01T00:00:00"}, 0),
+        ],
+    )
+    def test_post_filters(
+        self,
+        client: FlaskClient,
+        auth_headers: dict,
+        keywords,
+        filters: dict,
+        num_papers: int,
+    ):
+        """
+        Datasets can be narrowed by keyword score, token count and publication
+        date
+        """
+        response = client.post(
+            "/filter-task",
+            json={"keywords": ["pain OR back pain"], **filters},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+        task: FilterTaskModel = (
+            db.session.query(FilterTaskModel).filter_by(id=response.json["id"]).one()
+        )
+        WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        assert task.is_error is False
+        assert task.dataset.num_papers == num_papers
+
+    def test_post_filters_not_reused(
+        self, client: FlaskClient, auth_headers: dict, papers, keywords
+    ):
+        """
+        The same keywords with different filters produce different datasets
+        """
+        client.post("/filter-task", json={"keywords": ["pain"]}, headers=auth_headers)
+        WorkerRunner(FilterWorker())._tick(db.session)  # pylint: disable=W0212
+        db.session.commit()
+
+        response = client.post(
+            "/filter-task",
+            json={"keywords": ["pain"], "min_score": 0.5},
+            headers=auth_headers,
+        )
+        assert response.json["is_complete"] is False
+
+    def test_post_invalid_range(self, client: FlaskClient, auth_headers: dict):
+        """
+        Ranges must not be empty
+        """
+        response = client.post(
+            "/filter-task",
+            json={"keywords": ["pain"], "min_tokens": 3, "max_tokens": 2},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    def test_post_mixed_dates(self, client: FlaskClient, auth_headers: dict):
+        """
+        Dates with and without an offset are compared and stored as naive UTC
+        """
+        response = client.post(
+            "/filter-task",
+            json={
+                "keywords": ["pain"],
+                "min_date": "2000-01-01T02:00:00+02:00",
+                "max_date": "2001-01-01T00:00:00",
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+        task: FilterTaskModel = (
+            db.session.query(FilterTaskModel).filter_by(id=response.json["id"]).one()
+        )
+        assert task.min_date == datetime(2000, 1, 1)
+
+        response = client.get(
+            "/filter-task/estimate",
+            query_string={
+                "keywords": ["pain"],
+                "min_date": "2001-01-01T00:00:00Z",
+                "max_date": "2000-01-01T00:00:00",
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    def test_post_invalid_query(self, client: FlaskClient, auth_headers: dict):
+        """
+        Malformed keyword queries are rejected
+        """
+        response = client.post(
+            "/filter-task", json={"keywords": ["NOT", "pain"]}, headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    def test_estimate(self, client: FlaskClient, auth_headers: dict, papers, keywords):
+        """
+        GET /filter-task/estimate estimates dataset size from keyword document
+        frequencies
+        """
+        response = client.get(
+            "/filter-task/estimate?keywords=pain%20OR%20back%20pain",
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["num_papers"] == 2
+        assert response.json["num_ngrams"] == db.session.query(NgramModel).count()
+
+        response = client.get(
+            "/filter-task/estimate?keywords=pain&keywords=AND&keywords=back%20pain",
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["num_papers"] == 1
+
+        response = client.get(
+            "/filter-task/estimate?keywords=NOT%20pain", headers=auth_headers
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
     def test_list(self, client: FlaskClient, auth_headers: dict, filter_tasks):
         """
         GET /filter-task should list filter tasks for the current user,
@@ -0,0 +1,183 @@
+"""
+Functional requirements: FR5
+"""
+
+from datetime import datetime
+
+import pytest
+from flask.testing import FlaskClient
+
+from api import keyword_query
+from api.database import KeywordPostingModel, db
+from api.keyword_query import (
+    And,
+    Not,
+    Or,
+    PaperFilters,
+    QueryPlanner,
+    QuerySyntaxError,
+    Term,
+    filter_dates,
+    parse_query,
+    query_key,
+)
+
+
+@pytest.fixture()
+def postings(client: FlaskClient):
+    with client.application.app_context():
+        postings_ = [
+            KeywordPostingModel(keywords_lc="pain", doc_ids=[1, 2, 3, 4], doc_freq=4),
+            KeywordPostingModel(keywords_lc="back pain", doc_ids=[1, 2], doc_freq=2),
+            KeywordPostingModel(keywords_lc="spine", doc_ids=[2, 5], doc_freq=2),
+            KeywordPostingModel(keywords_lc="neck", doc_ids=[3], doc_freq=1),
+        ]
+        db.session.add_all(postings_)
+        db.session.commit()
+        yield postings_
+
+
+class TestParseQuery:
+    def test_phrase(self):
+        """
+        Consecutive words are a single lower case phrase
+        """
+        query = parse_query("Back  Pain")
+        assert isinstance(query, Term)
+        assert query.keywords_lc == "back pain"
+
+    def test_operators(self):
+        """
+        NOT binds tighter than AND, which binds tighter than OR
+        """
+        query = parse_query("back pain AND NOT spine OR neck")
+        assert isinstance(query, Or)
+        conjunction, term = query.children
+        assert isinstance(conjunction, And)
+        assert isinstance(conjunction.children[1], Not)
+        assert term.keywords_lc == "neck"
+
+    def test_quoted(self):
+        """
+        Quoted phrases can contain operator words
+        """
+        query = parse_query('"research AND development" AND (spine OR neck)')
+        assert isinstance(query, And)
+        assert query.children[0].keywords_lc == "research and development"
+        assert isinstance(query.children[1], Or)
+
+    @pytest.mark.parametrize(
+        "text",
+        [
+            "",
+            "pain AND",
+            "(pain",
+            "pain)",
+            "NOT pain",
+            "pain OR NOT spine",
+            '"pain',
+            'pain "back',
+        ],
+    )
+    def test_invalid(self, text: str):
+        """
+        Malformed and unbounded queries are rejected
+        """
+        with pytest.raises(QuerySyntaxError):
+            parse_query(text)
+
+
+class TestQueryKey:
+    def test_equivalent_queries(self):
+        """
+        Queries differing only in case, spacing, order and nesting share a key
+        """
+        key = query_key(parse_query("back pain AND (spine OR neck)"))
+        assert key == query_key(parse_query("(NECK OR spine) AND  Back Pain"))
+        assert key == query_key(parse_query("back pain AND (spine OR neck OR spine)"))
+        assert key == query_key(
+            parse_query("back pain AND ((spine OR neck) AND back pain)")
+        )
+
+    def test_different_queries(self):
+        assert query_key(parse_query("a AND b")) != query_key(parse_query("a OR b"))
+        assert query_key(parse_query("a AND NOT b")) != query_key(
+            parse_query("b AND NOT a")
+        )
+
+
+class TestQueryPlanner:
+    @pytest.mark.parametrize(
+        "text,expected",
+        [
+            ("pain", [1, 2, 3, 4]),
+            ("pain AND spine", [2]),
+            ("spine OR neck", [2, 3, 5]),
+            ("pain AND NOT back pain", [3, 4]),
+            ("pain AND (spine OR neck)", [2, 3]),
+            ("pain AND (neck OR NOT back pain)", [3, 4]),
+            ("pain AND asdf", []),
+        ],
+    )
+    def test_execute(self, postings, text: str, expected: list[int]):
+        assert QueryPlanner(db.session, parse_query(text)).execute() == expected
+
+    def test_skips_broad_terms(self, postings, monkeypatch):
+        """
+        Postings are not fetched once a narrower term has ruled everything out
+        """
+        fetched = []
+        original = QueryPlanner._evaluate_term  # pylint: disable=W0212
+
+        def evaluate_term(self, term, candidates):
+            fetched.append(term.keywords_lc)
+            return original(self, term, candidates)
+
+        monkeypatch.setattr(QueryPlanner, "_evaluate_term", evaluate_term)
+        planner = QueryPlanner(db.session, parse_query("pain AND neck AND spine"))
+        assert planner.execute() == []
+        assert fetched == ["neck", "spine"]
+
+    def test_on_step(self, postings):
+        """
+        Progress is reported after every posting fetched
+        """
+        fractions = []
+        planner = QueryPlanner(
+            db.session,
+            parse_query("pain AND (spine OR neck)"),
+            on_step=fractions.append,
+        )
+        assert planner.execute() == [2, 3]
+        assert fractions == pytest.approx([1 / 3, 2 / 3, 1])
+
+    def test_looks_up_candidates(self, postings, monkeypatch):
+        """
+        Broad terms only look up the papers that survived the narrower ones
+        """
+        lookups = []
+        original = keyword_query.get_posting
+
+        def get_posting(session, keywords_lc, candidates=None):
+            lookups.append((keywords_lc, candidates))
+            return original(session, keywords_lc, candidates)
+
+        monkeypatch.setattr(keyword_query, "get_posting", get_posting)
+        assert QueryPlanner(db.session, parse_query("pain AND neck")).execute() == [3]
+        assert lookups == [("neck", None), ("pain", {3})]
+
+        lookups.clear()
+        monkeypatch.setattr(keyword_query, "MAX_LOOKUP_SIZE", 0)
+        assert QueryPlanner(db.session, parse_query("pain AND neck")).execute() == [3]
+        assert lookups == [("neck", None), ("pain", None)]
+
+    @pytest.mark.parametrize("max_lookup_size", [10000, 1])
+    def test_filter_dates(self, user, papers, monkeypatch, max_lookup_size: int):
+        """
+        Papers are filtered by date through lookups or a range scan alike
+        """
+        monkeypatch.setattr(keyword_query, "MAX_LOOKUP_SIZE", max_lookup_size)
+        filters = PaperFilters(min_date=datetime(2000, 1, 1))
+        assert filter_dates(db.session, {1, 2, 3}, filters) == {1, 2}
+        filters = PaperFilters(max_date=datetime(2000, 1, 1))
+        assert filter_dates(db.session, {1, 2, 3}, filters) == set()
@@ -5,23 +5,31 @@ Functional requirements: FR7,8,9
 import json
 from datetime import datetime
 from http import HTTPStatus
+from itertools import pairwise
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
+import numpy as np
 import pytest
 from flask.testing import FlaskClient
+from sqlalchemy import event
 
+from api import app
 from api.database import (
     DatasetModel,
     DatasetPaperModel,
     FilterTaskModel,
+    NgramModel,
     PaperModel,
+    TrainedModel,
     TrainTaskModel,
     UserModel,
     db,
 )
+from api.word2vec.corpus import read_corpus, tokenize
+from api.word2vec.embeddings import save_embeddings
 from api.workers import trainer
-from api.workers.trainer import TrainWorker
+from api.workers.trainer import TrainOptions, TrainWorker
 from api.workers.worker import WorkerRunner
 
 
@@ -39,7 +47,7 @@ def dataset(authorized_user: UserModel, papers: list[PaperModel]):
 
     db.session.add_all([dataset_, task])
     db.session.flush()
-    db.session.add(DatasetPaperModel(dataset_id=dataset_.id, dkey=papers[0].dkey))
+    db.session.add(DatasetPaperModel(dataset_id=dataset_.id, doc_id=papers[0].doc_id))
     db.session.commit()
     return dataset_
 
@@ -47,7 +55,7 @@ def dataset(authorized_user: UserModel, papers: list[PaperModel]):
 @pytest.fixture()
 def train_task(dataset: DatasetModel, hparams: dict):
     task = TrainTaskModel(
-        hparams=json.dumps(hparams), user=dataset.task.user, dataset=dataset
+        hparams=json.dumps(hparams), user=dataset.tasks[0].user, dataset=dataset
     )
     db.session.add(task)
     db.session.commit()
@@ -107,6 +115,104 @@ class TestTrainTask:
         assert task is not None
         assert task.dataset == dataset
 
+    def test_post_engine(
+        self,
+        client: FlaskClient,
+        dataset: DatasetModel,
+        hparams: dict,
+        auth_headers: dict,
+    ):
+        """
+        The training engine can be picked per task among the supported ones
+        """
+        response = client.post(
+            "/train-task",
+            json={"dataset_id": dataset.id, "hparams": {**hparams, "engine": "gensim"}},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+        response = client.post(
+            "/train-task",
+            json={"dataset_id": dataset.id, "hparams": {**hparams, "engine": "tf"}},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    @pytest.mark.parametrize(
+        "overrides",
+        [
+            {"engine": "gensim", "optimizer": "sgd"},
+            {"engine": "gensim", "validation_split": 0.1, "patience": 1},
+            {"engine": "gensim", "patience": 1},
+            {"engine": "gensim", "concurrent_steps": 0},
+        ],
+    )
+    def test_post_invalid_gensim_hparams(
+        self,
+        client: FlaskClient,
+        dataset: DatasetModel,
+        hparams: dict,
+        auth_headers: dict,
+        overrides: dict,
+    ):
+        """
+        The gensim engine rejects the hparams only the Keras engine uses
+        instead of ignoring them, and needs at least one worker thread
+        """
+        response = client.post(
+            "/train-task",
+            json={"dataset_id": dataset.id, "hparams": {**hparams, **overrides}},
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    def test_post_validation_split(
+        self,
+        client: FlaskClient,
+        dataset: DatasetModel,
+        hparams: dict,
+        auth_headers: dict,
+    ):
+        """
+        Early stopping holds out part of the corpus
+        """
+        response = client.post(
+            "/train-task",
+            json={
+                "dataset_id": dataset.id,
+                "hparams": {**hparams, "validation_split": 0.1, "patience": 1},
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.CREATED
+
+    @pytest.mark.parametrize("validation_split", [0.0, 1.0])
+    def test_post_invalid_validation_split(
+        self,
+        client: FlaskClient,
+        dataset: DatasetModel,
+        hparams: dict,
+        auth_headers: dict,
+        validation_split: float,
+    ):
+        """
+        Early stopping needs some but not all of the corpus held out
+        """
+        response = client.post(
+            "/train-task",
+            json={
+                "dataset_id": dataset.id,
+                "hparams": {
+                    **hparams,
+                    "validation_split": validation_split,
+                    "patience": 1,
+                },
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
     def test_list(
         self,
         client: FlaskClient,
@@ -145,6 +251,33 @@ class TestTrainTask:
         response = client.get(f"/train-task/{train_task.id+1}", headers=auth_headers)
         assert response.status_code == HTTPStatus.NOT_FOUND
 
+    def test_download_embeddings(
+        self,
+        client: FlaskClient,
+        train_task: TrainTaskModel,
+        auth_headers: dict,
+        data_root: Path,
+    ):
+        """
+        Can download the embeddings of a trained task as word2vec text
+        """
+        url = f"/train-task/{train_task.id}/embeddings"
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+        save_embeddings(data_root, ["a", "b"], [2, 1], np.array([[3.0, 4.0], [1, 0]]))
+        db.session.add(
+            TrainedModel(embeddings_filename=str(data_root), task=train_task)
+        )
+        db.session.commit()
+
+        response = client.get(url, headers=auth_headers)
+        assert response.status_code == HTTPStatus.OK
+        assert "attachment" in response.headers["Content-Disposition"]
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0] == "2 2"
+        assert [line.split()[0] for line in lines[1:]] == ["a", "b"]
+
     def test_suggest_hparams(self, client: FlaskClient, auth_headers: dict):
         """
         Can get suggested hyperparameters for the user to modify
@@ -161,30 +294,192 @@ class TestTrainTask:
             "window_size",
             "min_count",
             "subsample",
+            "engine",
         }
         assert set(response.json.keys()) == expected_keys
         assert response.json["embedding_size"] == 200
 
 
 class TestTrainWorker:
-    def test_write_corpus(self, dataset: DatasetModel):
+    def test_write_corpus(self, dataset: DatasetModel, data_root: Path):
+        """
+        Ngrams should be written to the corpus directory as token ids
+        """
+        trainer.write_corpus(db.session, dataset, data_root / "corpus")
+        db.session.commit()
+        data = read_corpus(data_root / "corpus")
+        assert data.vocab[:2] == ["aliqua", "incididunt"]
+        assert data.tokens[:2].tolist() == [0, 1]
+        assert data.counts[:2].tolist() == [9, 10]
+
+    def test_write_corpus_aggregate(self, dataset: DatasetModel, data_root: Path):
         """
-        Ngrams should be written to the corpus file
+        Each distinct ngram is written once with its total count
+        """
+        trainer.write_corpus(db.session, dataset, data_root / "corpus")
+        db.session.commit()
+        data = read_corpus(data_root / "corpus")
+        ngrams = {
+            tuple(data.tokens[start:end]) for start, end in pairwise(data.offsets)
+        }
+        assert len(ngrams) == len(data.counts)
+        aliqua_count = sum(
+            ngram_count
+            for ngram_lc, ngram_count in db.session.query(
+                NgramModel.ngram_lc, NgramModel.ngram_count
+            ).filter_by(doc_id=1)
+            if tokenize(ngram_lc.split()) == ["aliqua"]
+        )
+        assert data.counts[0] == aliqua_count
+
+    def test_write_corpus_batches(self, dataset: DatasetModel, data_root: Path):
+        """
+        The corpus does not depend on the batch size ngrams are streamed in
+        """
+        trainer.write_corpus(db.session, dataset, data_root / "corpus")
+        trainer.write_corpus(
+            db.session, dataset, data_root / "batched_corpus", batch_size=7
+        )
+        db.session.commit()
+        for name in ["vocab.txt", "tokens.int32", "offsets.int64", "counts.int64"]:
+            assert (data_root / "corpus" / name).read_bytes() == (
+                data_root / "batched_corpus" / name
+            ).read_bytes()
+
+    def test_copy_ngrams(self, dataset: DatasetModel):
+        """
+        Dataset ngrams are exported as tab separated lines
         """
         with NamedTemporaryFile() as file:
-            trainer.write_corpus(db.session, dataset, Path(file.name))
+            trainer.copy_ngrams(db.session, dataset, file)
             db.session.commit()
-            assert file.read().decode().splitlines()[:2] == [
-                "aliqua\t2",
-                "incididunt\t7",
-            ]
+            file.seek(0)
+            lines = file.read().decode().splitlines()
+            assert lines[:2] == ["aliqua\t2", "incididunt\t7"]
+            assert (
+                len(lines) == db.session.query(NgramModel).filter_by(doc_id=1).count()
+            )
+
+    def test_stream_ngrams(self, dataset: DatasetModel):
+        """
+        Ngrams are streamed in batches of at most batch_size rows
+        """
+        batches = list(trainer.stream_ngrams(db.session, dataset, batch_size=100))
+        db.session.commit()
+        assert all(len(batch) <= 100 for batch in batches)
+        assert len(batches) > 1
+
+    def test_export_shards(
+        self, dataset: DatasetModel, papers: list[PaperModel], data_root: Path
+    ):
+        """
+        Shards partition the dataset by doc_id and together hold every row
+        """
+        db.session.add(
+            DatasetPaperModel(dataset_id=dataset.id, doc_id=papers[1].doc_id)
+        )
+        db.session.commit()
+
+        assert trainer.partition_doc_ids(db.session, dataset, 3) == [(1, 1), (2, 2)]
+
+        with open(data_root / "corpus.raw", "wb") as file:
+            trainer.copy_ngrams(db.session, dataset, file)
+        filenames = trainer.export_shards(
+            db.session, dataset, data_root / "corpus", num_shards=3
+        )
+        db.session.commit()
+        assert len(filenames) == 2
+
+        shard_lines = []
+        for filename in filenames:
+            shard_lines.extend(filename.read_text().splitlines())
+        lines = (data_root / "corpus.raw").read_text().splitlines()
+        assert sorted(shard_lines) == sorted(lines)
+
+    def test_reuse_phraser(
+        self,
+        dataset: DatasetModel,
+        papers: list[PaperModel],
+        data_root: Path,
+        monkeypatch,
+    ):
+        """
+        The phrase model of a dataset is fitted once, and again only after the
+        dataset's papers change
+        """
+        fitted = []
+        original = trainer.fit_phraser
+
+        def fit_phraser(filenames, batch_size, processes=1):
+            fitted.append(dataset.id)
+            return original(filenames, batch_size, processes)
+
+        monkeypatch.setattr(trainer, "fit_phraser", fit_phraser)
+
+        corpus_directory = data_root / "corpus"
+        trainer.write_corpus(
+            db.session, dataset, corpus_directory, options=TrainOptions(data_root)
+        )
+        tokens = (corpus_directory / "tokens.int32").read_bytes()
+        phrases_filename = dataset.phrases_filename
+        assert Path(phrases_filename).exists()
+
+        trainer.write_corpus(
+            db.session, dataset, corpus_directory, options=TrainOptions(data_root)
+        )
+        assert (corpus_directory / "tokens.int32").read_bytes() == tokens
+        assert len(fitted) == 1
+
+        db.session.add(
+            DatasetPaperModel(dataset_id=dataset.id, doc_id=papers[1].doc_id)
+        )
+        db.session.commit()
+        trainer.write_corpus(
+            db.session, dataset, corpus_directory, options=TrainOptions(data_root)
+        )
+        assert len(fitted) == 2
+        assert dataset.phrases_filename != phrases_filename
+        assert not Path(phrases_filename).exists()
+
+    def test_discard_checkpoint(
+        self, train_task: TrainTaskModel, data_root: Path, monkeypatch
+    ):
+        """
+        The checkpoint of a task that fails is removed, as it will not resume
+        """
+
+        def train(*_):
+            raise RuntimeError("something happened!")
+
+        monkeypatch.setattr(trainer.word2vec, "train", train)
+        checkpoint_directory = trainer.checkpoint_directory(data_root, train_task)
+        checkpoint_directory.mkdir(parents=True)
+
+        runner = WorkerRunner(TrainWorker(TrainOptions(data_root)))
+        with pytest.raises(RuntimeError):
+            runner._tick(db.session)  # pylint: disable=W0212
+        assert train_task.is_error is True
+        assert train_task.attempts == 1
+        assert not checkpoint_directory.exists()
+
+    def test_epochs_trained(
+        self, train_task: TrainTaskModel, data_root: Path, monkeypatch
+    ):
+        """
+        The number of epochs trained is recorded on the task
+        """
+        monkeypatch.setattr(trainer, "generate_visualization", lambda _: "{}")
+        runner = WorkerRunner(TrainWorker(TrainOptions(data_root)))
+        runner._tick(db.session)  # pylint: disable=W0212
+        assert train_task.is_error is False
+        assert train_task.epochs_trained == 1
 
     def test_generate_visualization(self, dataset: DatasetModel, hparams: dict):
         """
         Should generate TSNe raw data for embeddings
         """
         task = TrainTaskModel(
-            hparams=json.dumps(hparams), user=dataset.task.user, dataset=dataset
+            hparams=json.dumps(hparams), user=dataset.tasks[0].user, dataset=dataset
         )
         db.session.add(task)
         db.session.commit()
@@ -205,7 +500,7 @@ class TestTrainWorker:
         Should save model to the db
         """
         task = TrainTaskModel(
-            hparams=json.dumps(hparams), user=dataset.task.user, dataset=dataset
+            hparams=json.dumps(hparams), user=dataset.tasks[0].user, dataset=dataset
         )
         db.session.add(task)
         db.session.commit()
@@ -225,14 +520,131 @@ class TestTrainWorker:
         Should successfully train, producing a model
         """
         task = TrainTaskModel(
-            hparams=json.dumps(hparams), user=dataset.task.user, dataset=dataset
+            hparams=json.dumps(hparams), user=dataset.tasks[0].user, dataset=dataset
         )
         db.session.add(task)
         db.session.commit()
 
-        WorkerRunner(TrainWorker(data_root))._tick(db.session)  # pylint: disable=W0212
+        runner = WorkerRunner(TrainWorker(TrainOptions(data_root)))
+        runner._tick(db.session)  # pylint: disable=W0212
         db.session.commit()
 
         assert task.model is not None
         assert task.is_complete is True
         assert task.is_error is False
+
+
+class TestExportProcesses:
+    @pytest.fixture()
+    def client(self, data_root: Path):
+        """
+        A file-backed database, which the export processes open their own
+        connections to
+        """
+        app.config.update({"TESTING": True})
+        app.config.update(
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{data_root / 'api.db'}"}
+        )
+        test_client = app.test_client()
+
+        with test_client.application.app_context():
+            event.listen(
+                db.engine,
+                "connect",
+                lambda connection, _: connection.execute(
+                    f"attach '{data_root / 'docs.db'}' as docs"
+                ),
+            )
+            db.Model.metadata.create_all(db.engine)
+
+        yield test_client
+
+        with test_client.application.app_context():
+            db.session.remove()
+            db.Model.metadata.drop_all(db.engine)
+
+    def test_export_shards(
+        self, dataset: DatasetModel, papers: list[PaperModel], data_root: Path
+    ):
+        """
+        Shards exported by separate processes together hold every row
+        """
+        db.session.add(
+            DatasetPaperModel(dataset_id=dataset.id, doc_id=papers[1].doc_id)
+        )
+        db.session.commit()
+
+        with open(data_root / "corpus.raw", "wb") as file:
+            trainer.copy_ngrams(db.session, dataset, file)
+        filenames = trainer.export_shards(
+            db.session, dataset, data_root / "corpus", num_shards=2, processes=2
+        )
+        assert len(filenames) == 2
+
+        shard_lines = []
+        for filename in filenames:
+            shard_lines.extend(filename.read_text().splitlines())
+        lines = (data_root / "corpus.raw").read_text().splitlines()
+        assert sorted(shard_lines) == sorted(lines)
+
+    def test_write_corpus(
+        self, dataset: DatasetModel, papers: list[PaperModel], data_root: Path
+    ):
+        """
+        Ngrams phrase merged and tokenized by separate processes add up to the
+        same corpus as those of a single process
+        """
+        db.session.add(
+            DatasetPaperModel(dataset_id=dataset.id, doc_id=papers[1].doc_id)
+        )
+        db.session.commit()
+
+        corpora = []
+        for processes in [1, 2]:
+            directory = data_root / f"corpus_{processes}"
+            trainer.write_corpus(
+                db.session,
+                dataset,
+                directory,
+                options=TrainOptions(data_root, export_processes=processes),
+            )
+            data = read_corpus(directory)
+            corpora.append(
+                {
+                    tuple(data.vocab[token] for token in data.tokens[start:end]): count
+                    for (start, end), count in zip(
+                        pairwise(data.offsets), data.counts.tolist()
+                    )
+                }
+            )
+        assert corpora[0] == corpora[1]
+
+    def test_fit_phraser(
+        self,
+        dataset: DatasetModel,
+        papers: list[PaperModel],
+        data_root: Path,
+        monkeypatch,
+    ):
+        """
+        Vocabularies counted by separate processes, one shard each, merge into
+        the same phrase model as one counted over the whole dataset
+        """
+        monkeypatch.setattr(trainer, "PHRASES_PARAMS", {"min_count": 2, "threshold": 1})
+        db.session.add(
+            DatasetPaperModel(dataset_id=dataset.id, doc_id=papers[1].doc_id)
+        )
+        db.session.commit()
+
+        filenames = trainer.export_shards(
+            db.session, dataset, data_root / "whole", num_shards=1
+        )
+        phrasegrams = trainer.fit_phraser(filenames, 100).phrasegrams
+        assert phrasegrams
+
+        filenames = trainer.export_shards(
+            db.session, dataset, data_root / "sharded", num_shards=2
+        )
+        assert trainer.fit_phraser(filenames, 100, processes=2).phrasegrams == (
+            phrasegrams
+        )
@@ -9,16 +9,30 @@ import pytest
 from flask.testing import FlaskClient
 
 from api.database import TrainedModel, TrainTaskModel, UserModel, db
+from api.word2vec.embeddings import load_embeddings, save_embeddings
 
 DATA_PATH = Path(__file__).parent / "data"
 
 
-@pytest.fixture()
-def trained_model(authorized_user: UserModel):
+@pytest.fixture(params=["text", "binary"])
+def trained_model(request, authorized_user: UserModel, tmp_path: Path):
+    """
+    A model with embeddings in the legacy word2vec text format, or converted
+    to the binary format
+    """
+    embeddings_path = DATA_PATH / "embeddings.txt"
+    if request.param == "binary":
+        keyed_vectors = load_embeddings(embeddings_path)
+        embeddings_path = tmp_path / "embeddings"
+        save_embeddings(
+            embeddings_path,
+            keyed_vectors.index_to_key,
+            [1] * len(keyed_vectors),
+            keyed_vectors.vectors,
+        )
+
     task = TrainTaskModel(hparams="{}", user=authorized_user, dataset_id=0)
-    model = TrainedModel(
-        embeddings_filename=str(DATA_PATH / "embeddings.txt"), task=task
-    )
+    model = TrainedModel(embeddings_filename=str(embeddings_path), task=task)
     db.session.add_all([task, model])
     db.session.commit()
     return model
@@ -2,9 +2,16 @@
 Functional requirements: FR8
 """
 
-from tempfile import NamedTemporaryFile
+from collections import Counter
+from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from api.word2vec import word2vec
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from api.word2vec import corpus, gensim_word2vec, word2vec
+from api.word2vec.embeddings import iter_text, load_embeddings, save_embeddings
 
 CORPUS = """
 chain or of nonconjugate polymer	1
@@ -24,22 +31,383 @@ exciton on the conjugate segment	1
 """
 
 
+@pytest.fixture()
+def hparams():
+    return {
+        "embedding_size": 2,
+        "epochs_to_train": 1,
+        "learning_rate": 0.025,
+        "num_neg_samples": 1,
+        "batch_size": 4,
+        "concurrent_steps": 2,
+        "window_size": 2,
+        "min_count": 0,
+        "subsample": 1e-3,
+    }
+
+
+@pytest.fixture()
+def corpus_directory():
+    with TemporaryDirectory() as directory:
+        rows = [line.split("\t") for line in CORPUS.strip().splitlines()]
+        corpus.write_corpus(rows, Path(directory))
+        yield directory
+
+
 class TestWord2Vec:
-    def test_word2vec(self):
+    def test_word2vec(self, hparams: dict, corpus_directory: str, tmp_path: Path):
+        hparams = {**hparams, "embedding_size": 1, "batch_size": 1}
+        word2vec.train(corpus_directory, tmp_path, hparams)
+        assert load_embeddings(tmp_path).vectors.shape == (28, 1)
+
+    def test_corpus(self):
+        """
+        Ngrams are stored as token ids without stop words and punctuation, and
+        ngrams without any other words are dropped
+        """
+        with TemporaryDirectory() as directory:
+            corpus.write_corpus(
+                [("the polymer's dye", 2), ("of the", 1), ("dye led", 3)],
+                Path(directory),
+            )
+            data = corpus.read_corpus(Path(directory))
+
+            assert data.vocab == ["polymers", "dye", "led"]
+            assert data.tokens.tolist() == [0, 1, 1, 2]
+            assert data.offsets.tolist() == [0, 2, 4]
+            assert data.counts.tolist() == [2, 3]
+
+    def test_corpus_aggregate(self):
+        """
+        Ngrams with the same tokens are stored once with their total count
+        """
+        with TemporaryDirectory() as directory:
+            corpus.write_corpus(
+                [("polymer dye", 2), ("dye", 1), ("the polymer dye", 3)],
+                Path(directory),
+                buffer_size=1,
+            )
+            data = corpus.read_corpus(Path(directory))
+
+            assert data.tokens.tolist() == [0, 1, 1]
+            assert data.offsets.tolist() == [0, 2, 3]
+            assert data.counts.tolist() == [5, 1]
+
+    def test_prepare_data(self):
+        """
+        Tokens are renumbered by frequency, rows are padded to a fixed length and
+        weighted by their counts instead of repeated
+        """
+        with TemporaryDirectory() as directory:
+            corpus.write_corpus(
+                [("polymer dye", 1), ("led dye", 3), ("dye", 1)], Path(directory)
+            )
+            sequences, weights, vocab, num_words = word2vec.prepare_data(
+                corpus.read_corpus(Path(directory)), {"min_count": 2}
+            )
+
+            assert vocab == ["", "dye", "led"]
+            assert num_words == 3
+            assert sequences.tolist() == [[2, 1, 0, 0, 0]]
+            assert weights.tolist() == [3]
+
+    def test_prepare_data_min_count(self, tmp_path: Path):
+        """
+        min_count applies to the total count of an ngram across the dataset, not
+        to its count in each paper
+        """
+        corpus.write_corpus([("polymer dye", 1), ("polymer dye", 1)], tmp_path)
+        sequences, weights, _, _ = word2vec.prepare_data(
+            corpus.read_corpus(tmp_path), {"min_count": 2}
+        )
+        assert sequences.tolist() == [[1, 2, 0, 0, 0]]
+        assert weights.tolist() == [2]
+
+    def test_training_data_weights(self):
+        """
+        Skipgrams carry the weight of their sequence, normalized to a mean of 1
+        """
         hparams = {
-            "embedding_size": 1,
-            "epochs_to_train": 1,
-            "learning_rate": 0.025,
             "num_neg_samples": 1,
-            "batch_size": 1,
-            "concurrent_steps": 12,
+            "batch_size": 1000,
             "window_size": 2,
-            "min_count": 0,
-            "subsample": 1e-3,
+            "subsample": 1e6,
+        }
+        sequences = np.array([[1, 2, 3, 0, 0], [1, 2, 3, 0, 0]])
+        training_data = word2vec.generate_training_data(
+            sequences, np.array([1.0, 3.0]), 4, hparams
+        )
+        _, labels, weights = next(iter(training_data))
+        assert len(labels) == len(weights)
+        assert sorted(set(weights.numpy().tolist())) == [0.5, 1.5]
+
+    def test_negative_sampling(self):
+        """
+        Negatives for all pairs are drawn at once from the unigram^0.75
+        distribution, which never yields padding
+        """
+        sequences = np.array([[1, 2, 0, 0, 0], [1, 0, 0, 0, 0]])
+        distribution = word2vec.negative_sampling_distribution(
+            sequences, np.array([1.0, 15.0]), 3
+        )
+        assert distribution[0] == 0
+        assert distribution[1] / distribution[2] == pytest.approx(16**0.75)
+
+        cdf = word2vec.cumulative_distribution(distribution)
+        assert cdf[-1] == 1
+        contexts, labels = word2vec.generate_negative_skipgrams(
+            np.array([2, 1, 2]),
+            cdf,
+            {"num_neg_samples": 4},
+            np.random.default_rng(0),
+        )
+        assert contexts.shape == labels.shape == (3, 5)
+        assert contexts[:, 0].tolist() == [2, 1, 2]
+        assert labels.tolist() == [[1, 0, 0, 0, 0]] * 3
+        assert (contexts[:, 1:] != 0).all()
+
+        contexts, _ = word2vec.generate_negative_skipgrams(
+            np.zeros(10000, dtype=np.int64),
+            cdf,
+            {"num_neg_samples": 1},
+            np.random.default_rng(0),
+        )
+        frequencies = np.bincount(contexts[:, 1], minlength=3) / len(contexts)
+        assert frequencies == pytest.approx(distribution, abs=0.02)
+
+    def test_positive_skipgrams(self):
+        """
+        Skipgrams of the whole sequence matrix match those of Keras
+        """
+        hparams = {"window_size": 2, "subsample": 1e6}
+        sequences = np.array([[1, 2, 3, 4, 5], [3, 1, 0, 0, 0], [0, 0, 0, 0, 0]])
+        targets, contexts, weights = word2vec.generate_positve_skipgrams(
+            sequences, np.array([1.0, 2.0, 3.0]), 6, hparams
+        )
+
+        expected = []
+        for sequence in sequences:
+            couples, _ = tf.keras.preprocessing.sequence.skipgrams(
+                sequence, vocabulary_size=6, window_size=2, negative_samples=0
+            )
+            expected.extend(tuple(couple) for couple in couples)
+        assert sorted(zip(targets.tolist(), contexts.tolist())) == sorted(expected)
+        assert sorted(weights.tolist()) == [1.0] * 14 + [2.0] * 2
+
+    def test_training_data_chunks(self, monkeypatch):
+        """
+        Examples are generated a chunk of sequences at a time, every epoch
+        """
+        monkeypatch.setattr(word2vec, "CHUNK_SIZE", 1)
+        hparams = {
+            "num_neg_samples": 2,
+            "batch_size": 4,
+            "window_size": 2,
+            "subsample": 1e6,
+        }
+        sequences = np.array([[1, 2, 3, 0, 0], [3, 1, 0, 0, 0], [2, 0, 0, 0, 0]])
+        training_data = word2vec.generate_training_data(
+            sequences, np.array([1.0, 1.0, 1.0]), 4, hparams
+        )
+        for _ in range(2):
+            batches = list(training_data)
+            assert [len(labels) for _, labels, _ in batches] == [4, 4]
+            for (_, contexts), _, weights in batches:
+                assert contexts.shape == (4, 3)
+                assert weights.numpy().tolist() == [1.0] * 4
+
+    def test_execution_modes(
+        self, hparams: dict, corpus_directory: str, tmp_path: Path
+    ):
+        """
+        Training can run eagerly for debugging, and the compiled and eager
+        modes can be benchmarked against each other
+        """
+        options = word2vec.FitOptions(run_eagerly=True)
+        word2vec.train(corpus_directory, tmp_path, hparams, options)
+        assert load_embeddings(tmp_path).vectors.shape == (28, 2)
+
+        sequences, weights, _, num_words = word2vec.process_data(
+            corpus_directory, hparams
+        )
+        training_data = word2vec.generate_training_data(
+            sequences, weights, num_words, hparams
+        )
+        rates = word2vec.benchmark_execution_modes(
+            training_data, num_words, hparams, steps=3
+        )
+        assert set(rates) == {"eager", "compiled"}
+        assert all(rate > 0 for rate in rates.values())
+
+    def test_linear_decay(self):
+        """
+        SGD decays the learning rate linearly to 0.0001 of its initial value
+        """
+        learning_rate = word2vec.linear_decay(0.5, total_steps=10)
+        assert float(learning_rate(0)) == pytest.approx(0.5)
+        assert float(learning_rate(5)) == pytest.approx(0.25, rel=1e-3)
+        assert float(learning_rate(10)) == pytest.approx(0.5 * 0.0001)
+
+    @pytest.mark.parametrize("optimizer,sparse", [("sgd", True), ("adam", False)])
+    def test_sgd_optimizer(self, optimizer: str, sparse: bool):
+        """
+        SGD only updates the embedding rows of the batch, where Adam's momentum
+        keeps updating the rows of earlier batches
+        """
+        hparams = {"learning_rate": 0.5, "optimizer": optimizer, "num_neg_samples": 1}
+        model = word2vec.Word2Vec(10, 4, hparams)
+        word2vec.compile_model(model, hparams, run_eagerly=False, total_steps=10)
+        labels = np.array([[1, 0], [1, 0]])
+        model.train_on_batch((np.array([1, 2]), np.array([[3, 4], [5, 6]])), labels)
+        before = model.get_layer("w2v_embedding").get_weights()[0]
+        model.train_on_batch((np.array([7, 8]), np.array([[3, 4], [5, 6]])), labels)
+        after = model.get_layer("w2v_embedding").get_weights()[0]
+
+        changed = np.nonzero((before != after).any(axis=1))[0].tolist()
+        assert changed == ([7, 8] if sparse else [1, 2, 7, 8])
+
+    def test_resume(
+        self, monkeypatch, hparams: dict, corpus_directory: str, tmp_path: Path
+    ):
+        """
+        Training resumes from the epoch after the last checkpoint
+        """
+        hparams = {**hparams, "epochs_to_train": 3}
+        epochs = []
+
+        def on_epoch_end(self, epoch, logs=None):
+            epochs.append(epoch)
+            if epoch == 1 and len(epochs) == 2:
+                raise RuntimeError("worker died")
+
+        monkeypatch.setattr(word2vec.StepRateLogger, "on_epoch_end", on_epoch_end)
+
+        checkpoint_directory = tmp_path / "checkpoint"
+        embeddings_path = tmp_path / "embeddings"
+        options = word2vec.FitOptions(checkpoint_directory=checkpoint_directory)
+        with pytest.raises(RuntimeError):
+            word2vec.train(corpus_directory, embeddings_path, hparams, options)
+        assert checkpoint_directory.exists()
+
+        word2vec.train(corpus_directory, embeddings_path, hparams, options)
+        assert epochs == [0, 1, 2]
+        assert not checkpoint_directory.exists()
+        assert load_embeddings(embeddings_path).vectors.shape == (28, 2)
+
+    def test_early_stopping(self, hparams: dict, corpus_directory: str, tmp_path: Path):
+        """
+        Training stops once the held-out loss stops improving
+        """
+        hparams = {
+            **hparams,
+            "epochs_to_train": 10,
+            # The held-out loss never changes without learning
+            "learning_rate": 0.0,
+            "validation_split": 0.5,
+            "patience": 1,
         }
 
-        with NamedTemporaryFile("w") as data_input, NamedTemporaryFile() as emb:
-            data_input.write(CORPUS)
-            data_input.flush()
-            word2vec.train(data_input.name, emb.name, hparams)
-            assert emb.read().decode().splitlines()[:1] == ["27 1"]
+        epochs_trained = word2vec.train(
+            corpus_directory, tmp_path, hparams, word2vec.FitOptions()
+        )
+        assert epochs_trained == 2
+
+    def test_split_sequences(self):
+        sequences = np.arange(20).reshape(10, 2)
+        (kept, kept_weights), (held_out, held_out_weights) = word2vec.split_sequences(
+            sequences, np.arange(10), 0.3
+        )
+        assert len(kept) == len(kept_weights) == 7
+        assert len(held_out) == len(held_out_weights) == 3
+        assert sorted(np.concatenate([kept, held_out])[:, 0] // 2) == list(range(10))
+        assert (held_out[:, 0] // 2 == held_out_weights).all()
+
+
+class TestGensimWord2Vec:
+    def test_word2vec(self, hparams: dict, corpus_directory: str, tmp_path: Path):
+        """
+        The gensim engine saves the same embeddings as the Keras engine
+        """
+        hparams = {**hparams, "embedding_size": 3, "engine": "gensim"}
+        gensim_word2vec.train(corpus_directory, tmp_path / "embeddings", hparams)
+        assert load_embeddings(tmp_path / "embeddings").vectors.shape == (28, 3)
+
+    def test_sentences(self, tmp_path: Path):
+        """
+        Sentences are written as lines of words repeated by their weights
+        """
+        filename = tmp_path / "sentences.txt"
+        num_sentences, num_words = gensim_word2vec.write_sentences(
+            np.array([[1, 2, 0], [2, 0, 0]]),
+            np.array([2.0, 1.0]),
+            ["", "a", "b"],
+            np.ones(3),
+            filename,
+        )
+        assert (num_sentences, num_words) == (3, 5)
+        assert filename.read_text(encoding="utf-8").splitlines() == ["a b", "a b", "b"]
+
+    def test_sentences_subsampled(self, tmp_path: Path):
+        """
+        Sentences are only repeated as often as subsampling keeps their words,
+        so the file does not grow with the weights of frequent words
+        """
+        filename = tmp_path / "sentences.txt"
+        num_sentences, _ = gensim_word2vec.write_sentences(
+            np.array([[1, 2, 0]]),
+            np.array([10000.0]),
+            ["", "a", "b"],
+            np.array([0.0, 0.01, 0.005]),
+            filename,
+        )
+        assert num_sentences == pytest.approx(100, abs=30)
+        counts = Counter(filename.read_text(encoding="utf-8").split())
+        assert counts["a"] == pytest.approx(100, abs=30)
+        assert counts["b"] == pytest.approx(50, abs=25)
+
+    def test_sentences_removed(self, hparams: dict, corpus_directory: str, tmp_path):
+        """
+        The sentences file is removed with the work directory after training
+        """
+        hparams = {**hparams, "engine": "gensim"}
+        work_directory = tmp_path / "work"
+        gensim_word2vec.train(
+            corpus_directory, tmp_path / "embeddings", hparams, work_directory
+        )
+        assert not work_directory.exists()
+
+
+class TestEmbeddings:
+    def test_save_load(self, tmp_path: Path):
+        """
+        Saved embeddings load with their vectors, counts and norms
+        """
+        vectors = np.array([[3.0, 4.0], [0.0, 0.0], [1.0, 0.0]])
+        save_embeddings(tmp_path, ["a", "b", "c"], [3, 2, 1], vectors)
+
+        assert np.allclose(
+            np.linalg.norm(np.load(tmp_path / "vectors.npy"), axis=1), [1, 0, 1]
+        )
+        keyed_vectors = load_embeddings(tmp_path)
+        assert keyed_vectors.index_to_key == ["a", "b", "c"]
+        assert np.allclose(keyed_vectors.vectors, vectors)
+        assert keyed_vectors.get_vecattr("a", "count") == 3
+        assert np.allclose(keyed_vectors.norms, [5, 0, 1])
+        assert keyed_vectors.most_similar("c", topn=1)[0][0] == "a"
+
+    def test_text_export(self, tmp_path: Path):
+        """
+        Embeddings export to the word2vec text format and load back from it
+        """
+        vectors = np.array([[3.0, 4.0], [1.0, 0.0]])
+        save_embeddings(tmp_path / "embeddings", ["a", "b"], [2, 1], vectors)
+
+        text_filename = tmp_path / "embeddings.txt"
+        text_filename.write_text(
+            "".join(iter_text(load_embeddings(tmp_path / "embeddings"))),
+            encoding="utf-8",
+        )
+        assert text_filename.read_text(encoding="utf-8").splitlines()[0] == "2 2"
+        keyed_vectors = load_embeddings(text_filename)
+        assert keyed_vectors.index_to_key == ["a", "b"]
+        assert np.allclose(keyed_vectors.vectors, vectors)
@@ -25,6 +25,7 @@ class MockTaskModel(db.Model):
     start_time = Column(DateTime, nullable=True)
     end_time = Column(DateTime, nullable=True)
     result = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
 
 
 class SuccessWorker(Worker):
@@ -37,6 +38,9 @@ class SuccessWorker(Worker):
 
 
 class FailWorker(Worker):
+    def __init__(self):
+        self.discarded = []
+
     @property
     def task_model(self):
         return MockTaskModel
@@ -44,6 +48,14 @@ class FailWorker(Worker):
     def execute(self, session: Session, task: MockTaskModel):
         raise RuntimeError("something happened!")
 
+    def discard(self, task: MockTaskModel):
+        self.discarded.append(task.id)
+
+
+class ResumableWorker(FailWorker):
+    resumable = True
+    max_attempts = 2
+
 
 class TestWorkerRunner:
     def test_tick_success(self, db_session: Session):
@@ -69,9 +81,52 @@ class TestWorkerRunner:
         db_session.add(task)
         db_session.commit()
 
+        worker = FailWorker()
         with pytest.raises(RuntimeError):
-            WorkerRunner(FailWorker())._tick(db_session)  # pylint: disable=W0212
+            WorkerRunner(worker)._tick(db_session)  # pylint: disable=W0212
+        assert worker.discarded == [task.id]
 
         assert task.start_time is not None
         assert task.end_time is not None
         assert task.result is None
+
+    def test_requeue_interrupted(self, db_session: Session):
+        """
+        Tasks that were started but never ended are queued again
+        """
+        interrupted = MockTaskModel(start_time=datetime.utcnow())
+        ended = MockTaskModel(start_time=datetime.utcnow(), end_time=datetime.utcnow())
+        db_session.add_all([interrupted, ended])
+        db_session.commit()
+
+        runner = WorkerRunner(SuccessWorker())
+        runner._requeue_interrupted(db_session)  # pylint: disable=W0212
+        assert interrupted.start_time is None
+        assert ended.start_time is not None
+
+        runner._tick(db_session)  # pylint: disable=W0212
+        assert interrupted.result == 1
+
+    def test_give_up_interrupted(self, db_session: Session):
+        """
+        Interrupted tasks are ended and discarded once they were started
+        max_attempts times
+        """
+        task = MockTaskModel()
+        db_session.add(task)
+        db_session.commit()
+
+        worker = ResumableWorker()
+        runner = WorkerRunner(worker)
+        for attempts in range(1, 3):
+            # Start the task and die while running it
+            next_task = runner._get_next_task(db_session)  # pylint: disable=W0212
+            next_task.start_time = datetime.utcnow()
+            next_task.attempts += 1
+            db_session.commit()
+            assert task.attempts == attempts
+
+            runner._requeue_interrupted(db_session)  # pylint: disable=W0212
+
+        assert task.end_time is not None
+        assert worker.discarded == [task.id]